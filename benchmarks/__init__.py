@@ -0,0 +1,13 @@
+"""
+Benchmarks for measuring how mkdocs performs as sites grow.
+
+Generate a synthetic site, time a set of scales, and compare two runs:
+
+    python -m benchmarks generate /tmp/corpus --pages 1000
+    python -m benchmarks run --scales 100,1000 --output after.json
+    python -m benchmarks compare before.json after.json
+
+Check that importing mkdocs stays fast:
+
+    python -m benchmarks startup
+"""
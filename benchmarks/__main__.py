@@ -0,0 +1,111 @@
+import json
+import sys
+import tempfile
+from typing import Optional
+
+import click
+
+from .compare import compare as compare_results
+from .corpus import CorpusSpec, generate as generate_corpus
+from .harness import run as run_benchmarks
+from .startup import BUDGET, check_startup, measure_startup
+
+
+def spec_options(func):
+    defaults = CorpusSpec()
+    options = [
+        click.option('--depth', type=int, default=defaults.depth, help='Levels of nested directories.'),
+        click.option('--paragraphs', type=int, default=defaults.paragraphs, help='Paragraphs per page.'),
+        click.option('--links', type=int, default=defaults.links, help='Links per page.'),
+        click.option('--code-blocks', type=int, default=defaults.code_blocks, help='Code blocks per page.'),
+        click.option('--tables', type=int, default=defaults.tables, help='Tables per page.'),
+        click.option('--seed', type=int, default=defaults.seed, help='Random seed.'),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.argument('directory')
+@click.option('--pages', type=int, default=CorpusSpec().pages, help='Number of pages.')
+@spec_options
+def generate(directory: str, **spec):
+    """
+    Generate a synthetic site in DIRECTORY.
+    """
+    generate_corpus(directory, CorpusSpec(**spec))
+
+@cli.command()
+@click.option('--scales', default='100,1000', help='Comma separated page counts.')
+@click.option('--directory', default=None, help='Where to generate sites. Defaults to a temporary directory.')
+@click.option('--output', '-o', default=None, help='Write the results to this JSON file.')
+@click.option('--jobs', '-j', type=int, default=1, help='Number of build worker processes.')
+@click.option('--requests', type=int, default=100, help='Number of pages to request when timing serve.')
+@click.option('--repeat', type=int, default=3, help='Number of times to repeat initialization.')
+@spec_options
+def run(scales: str, directory: Optional[str], output: Optional[str], jobs: int, requests: int, repeat: int, **spec):
+    """
+    Time initialize, build and serve at each scale.
+    """
+    def log(message: str) -> None:
+        click.echo(message, err=True)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = run_benchmarks(
+            directory or temp_dir,
+            scales=[int(scale) for scale in scales.split(',')],
+            spec=CorpusSpec(**spec),
+            jobs=jobs,
+            requests=requests,
+            repeat=repeat,
+            log=log,
+        )
+
+    text = json.dumps(results, indent=2)
+    if output is None:
+        click.echo(text)
+    else:
+        with open(output, 'w') as output_file:
+            output_file.write(text + '\n')
+
+@cli.command()
+@click.option('--budget', type=float, default=BUDGET, help='Milliseconds allowed for each case.')
+@click.option('--repeat', type=int, default=5, help='Number of times to time each case.')
+def startup(budget: float, repeat: int):
+    """
+    Check that importing mkdocs and running 'mkdocs --help' stay fast,
+    exiting with an error if either is over budget or imports heavy modules.
+    """
+    results = measure_startup(repeat)
+    click.echo(f"interpreter          {results['baseline']:>10.2f}ms")
+    for name, case in results.items():
+        if name != 'baseline':
+            click.echo(f"{name:<20} {case['time']:>10.2f}ms")
+    problems = check_startup(results, budget)
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        sys.exit(1)
+
+@cli.command()
+@click.argument('before', type=click.File())
+@click.argument('after', type=click.File())
+@click.option('--threshold', type=float, default=0.1, help='Fractional slowdown to report as a regression.')
+def compare(before, after, threshold: float):
+    """
+    Compare two sets of results, exiting with an error on any regressions.
+    """
+    lines, regressions = compare_results(json.load(before), json.load(after), threshold)
+    for line in lines:
+        click.echo(line)
+    if regressions:
+        click.echo(f'{regressions} regressions', err=True)
+        sys.exit(1)
+
+
+cli()
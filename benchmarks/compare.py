@@ -0,0 +1,42 @@
+from typing import Iterator
+
+
+def compare(before: dict, after: dict, threshold: float = 0.1) -> tuple[list[str], int]:
+    """
+    Compare the timings of two benchmark runs, at each scale they have in common.
+
+    Returns a line for each timing, and the number of timings that
+    are slower than before by more than the threshold.
+    """
+    sections = []
+    if 'startup' in before and 'startup' in after:
+        sections.append(('startup', before['startup'], after['startup']))
+    before_scales = {scale['pages']: scale for scale in before['scales']}
+    for scale in after['scales']:
+        previous = before_scales.get(scale['pages'])
+        if previous is not None:
+            sections.append((f"{scale['pages']} pages", previous['timings'], scale['timings']))
+
+    lines = []
+    regressions = 0
+    for title, old_timings, new_timings in sections:
+        lines.append(title)
+        old_values = dict(_flatten(old_timings))
+        for name, new in _flatten(new_timings):
+            old = old_values.get(name)
+            if old is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            regressed = change > threshold
+            regressions += regressed
+            marker = '  REGRESSION' if regressed else ''
+            lines.append(f'  {name:<20} {old:>10.2f}ms {new:>10.2f}ms {change:>+8.1%}{marker}')
+    return lines, regressions
+
+
+def _flatten(timings: dict, prefix: str = '') -> Iterator[tuple[str, float]]:
+    for key, value in timings.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and key != 'count':
+            yield f'{prefix}{key}', value
@@ -0,0 +1,156 @@
+import os
+import random
+import shutil
+from dataclasses import dataclass
+
+import yaml
+
+
+WORDS = (
+    'build serve page site theme config render markdown template index search '
+    'navigation section link static file cache request response header table '
+    'value option plugin extension output input directory module function class '
+    'argument return error warning default example usage install update release'
+).split()
+
+LANGUAGES = ('python', 'javascript', 'bash', 'yaml')
+
+
+@dataclass
+class CorpusSpec:
+    """
+    The shape of a synthetic documentation site.
+    """
+    pages: int = 100
+    # How many levels of nested directories, and navigation headers, to spread pages across.
+    depth: int = 2
+    # The number of paragraphs on each page. Every third paragraph starts a new section.
+    paragraphs: int = 12
+    links: int = 5
+    code_blocks: int = 2
+    tables: int = 1
+    seed: int = 0
+
+
+def generate(directory: str, spec: CorpusSpec) -> None:
+    """
+    Write a site with a 'mkdocs.yml' and a 'docs' directory, replacing any existing site.
+
+    The same spec always generates the same site.
+    """
+    docs_dir = os.path.join(directory, 'docs')
+    shutil.rmtree(docs_dir, ignore_errors=True)
+
+    rng = random.Random(spec.seed)
+    paths = [_page_path(index, spec) for index in range(spec.pages)]
+    for index, path in enumerate(paths):
+        output_path = os.path.join(docs_dir, path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'w') as output_file:
+            output_file.write(_page_text(index, path, paths, spec, rng))
+
+    config = {'site_name': f'Benchmark ({spec.pages} pages)', 'nav': _nav(paths)}
+    with open(os.path.join(directory, 'mkdocs.yml'), 'w') as output_file:
+        yaml.safe_dump(config, output_file, sort_keys=False)
+
+
+# ...
+
+def _page_path(index: int, spec: CorpusSpec) -> str:
+    """
+    Spread pages evenly across `depth` levels of directories,
+    with consecutive pages in the same directory.
+    """
+    if index == 0:
+        return 'index.md'
+    fanout = max(2, round(spec.pages ** (1 / (spec.depth + 1))))
+    directories = []
+    remaining = index // fanout
+    for _ in range(spec.depth):
+        remaining, digit = divmod(remaining, fanout)
+        directories.insert(0, f'section-{digit}')
+    return '/'.join(directories + [f'page-{index}.md'])
+
+
+def _nav(paths: list[str]) -> list[dict]:
+    """
+    Group pages under a header for each top level directory.
+    The default theme only renders one level of headers.
+    """
+    nav: list[dict] = []
+    headers: dict[str, list[dict]] = {}
+    for path in paths:
+        directory, _, _ = path.partition('/')
+        item = {_title(path): path}
+        if directory == path:
+            nav.append(item)
+            continue
+        if directory not in headers:
+            headers[directory] = []
+            nav.append({directory.replace('-', ' ').title(): headers[directory]})
+        headers[directory].append(item)
+    return nav
+
+
+def _title(path: str) -> str:
+    name = os.path.splitext(os.path.basename(path))[0]
+    return 'Home' if name == 'index' else name.replace('-', ' ').title()
+
+
+def _page_text(index: int, path: str, paths: list[str], spec: CorpusSpec, rng: random.Random) -> str:
+    blocks = [f'# {_title(path)}']
+    directory = os.path.dirname(path)
+    links = [
+        os.path.relpath(target, directory or '.').replace(os.sep, '/')
+        for target in rng.sample(paths, min(spec.links, len(paths)))
+    ]
+
+    # Interleave code blocks and tables evenly through the paragraphs.
+    extras = ['code'] * spec.code_blocks + ['table'] * spec.tables
+    positions = {
+        round((position + 1) * spec.paragraphs / (len(extras) + 1)): extra
+        for position, extra in enumerate(extras)
+    }
+
+    for paragraph in range(spec.paragraphs):
+        if paragraph and paragraph % 3 == 0:
+            blocks.append(f'## {_sentence(rng, 3).rstrip(".")}')
+        sentences = [_sentence(rng, rng.randint(8, 16)) for _ in range(rng.randint(3, 6))]
+        if links:
+            target = links.pop()
+            sentences.append(f'See [{_title(target)}]({target}).')
+        blocks.append(' '.join(sentences))
+
+        extra = positions.get(paragraph)
+        if extra == 'code':
+            blocks.append(_code_block(rng))
+        elif extra == 'table':
+            blocks.append(_table(rng))
+
+    return '\n\n'.join(blocks) + '\n'
+
+
+def _sentence(rng: random.Random, length: int) -> str:
+    words = [rng.choice(WORDS) for _ in range(length)]
+    if rng.random() < 0.3:
+        words[rng.randrange(length)] = f'`{rng.choice(WORDS)}`'
+    return ' '.join(words).capitalize() + '.'
+
+
+def _code_block(rng: random.Random) -> str:
+    lines = [
+        f'{rng.choice(WORDS)}_{number} = {rng.choice(WORDS)}({rng.randint(0, 100)})'
+        for number in range(rng.randint(4, 12))
+    ]
+    return '\n'.join([f'```{rng.choice(LANGUAGES)}', *lines, '```'])
+
+
+def _table(rng: random.Random) -> str:
+    columns = 3
+    rows = [
+        [rng.choice(WORDS) for _ in range(columns)]
+        for _ in range(rng.randint(3, 8))
+    ]
+    header = [word.title() for word in rng.sample(WORDS, columns)]
+    lines = [header, ['---'] * columns, *rows]
+    return '\n'.join('| ' + ' | '.join(line) + ' |' for line in lines)
@@ -0,0 +1,170 @@
+import contextlib
+import datetime
+import io
+import os
+import platform
+import random
+import shutil
+import subprocess
+import time
+from dataclasses import asdict, replace
+from typing import Any, Callable, Optional
+
+import flask
+
+from mkdocs import MkDocs
+from mkdocs.utils import load_yaml, merge_dict
+
+from .corpus import CorpusSpec, generate
+from .startup import measure_startup
+
+
+def run(
+    directory: str,
+    scales: list[int],
+    spec: CorpusSpec = CorpusSpec(),
+    jobs: int = 1,
+    requests: int = 100,
+    repeat: int = 3,
+    log: Optional[Callable[[str], None]] = None,
+) -> dict:
+    """
+    Generate a site for each scale in the given directory, and time it.
+
+    Returns the results as a JSON-serializable dict.
+    """
+    results: dict[str, Any] = {'meta': _metadata(jobs), 'scales': []}
+    if log is not None:
+        log('Timing startup')
+    results['startup'] = measure_startup(repeat=max(repeat, 5))
+    for pages in scales:
+        scale_spec = replace(spec, pages=pages)
+        root = os.path.join(directory, f'pages-{pages}')
+        if log is not None:
+            log(f'Generating {pages} pages in {root!r}')
+        generate(root, scale_spec)
+        if log is not None:
+            log(f'Timing {pages} pages')
+        results['scales'].append({
+            'pages': pages,
+            'spec': asdict(scale_spec),
+            'timings': measure(root, jobs=jobs, requests=requests, repeat=repeat),
+        })
+    return results
+
+
+def measure(root: str, jobs: int = 1, requests: int = 100, repeat: int = 3) -> dict:
+    """
+    Time the stages of building and serving a generated site, in milliseconds.
+
+    * 'initialize' - loading the site. The fastest of `repeat` runs.
+    * 'build' - a clean build, with no manifest or caches.
+    * 'rebuild' - a build immediately afterwards, where nothing has changed.
+    * 'serve_cold' - the first request for each of a sample of pages, on a fresh server
+      without any converted markdown cached on disk.
+    * 'serve_warm' - a second request for each of those pages.
+    """
+    config = _config(root, jobs)
+    for path in (config['directories']['build'], config['directories']['cache']):
+        shutil.rmtree(path, ignore_errors=True)
+    if os.path.exists(config['build']['manifest']):
+        os.remove(config['build']['manifest'])
+
+    timings: dict[str, Any] = {}
+    timings['initialize'] = min(_time(lambda: MkDocs(config).initialize()) for _ in range(repeat))
+
+    for key in ('build', 'rebuild'):
+        md = MkDocs(config)
+        site = md.initialize()
+        with contextlib.redirect_stdout(io.StringIO()):
+            timings[key] = _time(lambda: md.build(site))
+
+    # The builds leave converted markdown in the cache, which would
+    # otherwise make the first request for each page a cache hit.
+    shutil.rmtree(os.path.join(config['directories']['cache'], 'markdown'), ignore_errors=True)
+
+    md = MkDocs(config)
+    site = md.initialize()
+    app = flask.Flask(__name__)
+    urls = [page.url for page in site.pages]
+    urls = random.Random(0).sample(urls, min(requests, len(urls)))
+    for key in ('serve_cold', 'serve_warm'):
+        timings[key] = _summarize([_time_request(md, site, app, url) for url in urls])
+
+    return timings
+
+
+# ...
+
+def _config(root: str, jobs: int) -> dict:
+    # Use absolute paths, rather than changing the working directory.
+    config = load_yaml(os.path.join(root, 'mkdocs.yml'))
+    return merge_dict(config, {
+        'build': {
+            'jobs': jobs,
+            'manifest': os.path.join(root, '.mkdocs-manifest.json'),
+        },
+        'directories': {
+            'docs': os.path.join(root, 'docs'),
+            'build': os.path.join(root, 'site'),
+            'cache': os.path.join(root, '.mkdocs-cache'),
+        },
+    })
+
+
+def _time(func: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def _time_request(md: MkDocs, site: Any, app: flask.Flask, url: str) -> float:
+    with app.test_request_context(url):
+        start = time.perf_counter()
+        response = md.serve(site, url)
+        assert response is not None, url
+        # Consume the body, in case it is streamed.
+        response.get_data()
+        return (time.perf_counter() - start) * 1000
+
+
+def _summarize(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean': sum(ordered) / len(ordered),
+        'p50': _percentile(ordered, 50),
+        'p99': _percentile(ordered, 99),
+        'max': ordered[-1],
+    }
+
+
+def _percentile(ordered: list[float], percent: float) -> float:
+    # The nearest-rank method, which always returns an actual sample.
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _metadata(jobs: int) -> dict:
+    return {
+        'commit': _git_commit(),
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'jobs': jobs,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
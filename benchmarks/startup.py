@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+# Modules that should only be imported by the commands and handlers that use them.
+HEAVY_MODULES = (
+    'flask', 'werkzeug', 'jinja2', 'markdown', 'markdown_gfm_admonition',
+    'mdx_linkify', 'slugify', 'yaml', 'watchdog', 'lunr', 'brotli',
+)
+
+# The code to time for each startup case.
+CASES = {
+    'import': 'import mkdocs',
+    'help': 'import mkdocs\ntry:\n    mkdocs.cli(["--help"])\nexcept SystemExit:\n    pass',
+}
+
+# The default budget for each case, in milliseconds on top of starting the interpreter.
+BUDGET = 150.0
+
+_REPORT_MODULES = '\nimport json, sys\nsys.stderr.write(json.dumps(sorted(sys.modules)))'
+
+
+def measure_startup(repeat: int = 5) -> dict:
+    """
+    Time each startup case in a fresh interpreter, in milliseconds,
+    excluding the time to start the interpreter itself.
+
+    Also returns any heavy modules that each case imported.
+    """
+    baseline = min(_time_process('pass')[0] for _ in range(repeat))
+    results: dict = {'baseline': baseline}
+    for name, code in CASES.items():
+        timings = []
+        for _ in range(repeat):
+            duration, modules = _time_process(code + _REPORT_MODULES)
+            timings.append(duration)
+        results[name] = {
+            'time': max(0.0, min(timings) - baseline),
+            'heavy_modules': sorted(
+                module for module in HEAVY_MODULES if module in modules
+            ),
+        }
+    return results
+
+
+def check_startup(results: dict, budget: float = BUDGET) -> list[str]:
+    """
+    Return a description of each case that is over budget,
+    or that imports heavy modules.
+    """
+    problems = []
+    for name in CASES:
+        case = results[name]
+        if case['time'] > budget:
+            problems.append(f"'{name}' took {case['time']:.1f}ms, over the budget of {budget:.1f}ms")
+        if case['heavy_modules']:
+            problems.append(f"'{name}' imported {', '.join(case['heavy_modules'])}")
+    return problems
+
+
+# ...
+
+def _time_process(code: str) -> tuple[float, set[str]]:
+    # Run from the repository root, so that the working tree is what gets imported.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    duration = (time.perf_counter() - start) * 1000
+    modules = set(json.loads(result.stderr)) if result.stderr.startswith('[') else set()
+    return duration, modules
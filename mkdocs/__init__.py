@@ -1,13 +1,45 @@
-from .core import MkDocs, cli
-from .handlers.files import StaticFilesHandler
-from .handlers.navigation import NavigationHandler
-from .handlers.pages import PagesHandler
-from .utils import load_json
+from typing import TYPE_CHECKING
+import importlib
+
+
+# Exports are imported on first use, so that importing `mkdocs`
+# (eg. to run 'mkdocs --help') doesn't import every handler.
+_EXPORTS = {
+    'MkDocs': '.core',
+    'cli': '.core',
+    'create_app': '.core',
+    'CompressionHandler': '.handlers.compression',
+    'StaticFilesHandler': '.handlers.files',
+    'NavigationHandler': '.handlers.navigation',
+    'PagesHandler': '.handlers.pages',
+    'SearchHandler': '.handlers.search',
+    'load_json': '.utils',
+}
+
+if TYPE_CHECKING:
+    from .core import MkDocs, cli, create_app
+    from .handlers.compression import CompressionHandler
+    from .handlers.files import StaticFilesHandler
+    from .handlers.navigation import NavigationHandler
+    from .handlers.pages import PagesHandler
+    from .handlers.search import SearchHandler
+    from .utils import load_json
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
 
 
 __all__ = [
-    MkDocs,
-    StaticFilesHandler,
-    NavigationHandler,
-    PagesHandler
-]
\ No newline at end of file
+    'MkDocs',
+    'create_app',
+    'CompressionHandler',
+    'StaticFilesHandler',
+    'NavigationHandler',
+    'PagesHandler',
+    'SearchHandler',
+]
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, TypeVar
+import hashlib
+import os
+import threading
+
+from .utils import hash_data
+
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """
+    A thread-safe, size-bounded, least-recently-used cache.
+
+    Each entry is stored along with a fingerprint of the inputs that produced it.
+    Lookups with a different fingerprint are treated as misses, so callers
+    can invalidate entries by including eg. file modification times in the
+    fingerprint, without having to explicitly track changes.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[Hashable, tuple[Any, V, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, fingerprint: Any) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != fingerprint:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, fingerprint: Any, value: V, size: int, evict: bool = True) -> None:
+        """
+        Add an entry, evicting the least recently used entries to make space.
+        Without `evict`, the entry is only added if there is space for it already.
+        """
+        if size > self.max_bytes:
+            # Never cache values which would take up the entire cache.
+            return
+        with self._lock:
+            if not evict:
+                existing = self._entries.get(key)
+                if self.total_bytes - (0 if existing is None else existing[2]) + size > self.max_bytes:
+                    return
+            self._discard(key)
+            self._entries[key] = (fingerprint, value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._discard(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class DiskCache:
+    """
+    A cache of rendered content in a directory, which can be shared
+    between processes, such as the workers of a prefork server.
+
+    As with `LRUCache`, each entry is stored along with a fingerprint of
+    its inputs, and lookups with a different fingerprint are misses.
+    There is a single entry per key. Entries are replaced atomically,
+    so readers never see a partially written entry.
+
+    With `max_bytes`, each hit marks the entry as recently used, and
+    `prune()` removes the least recently used entries to fit. Otherwise
+    the size of the cache is bounded by the number of distinct keys.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = None) -> None:
+        self._directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key: str, fingerprint: Any) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                digest = file.readline().rstrip(b'\n').decode('ascii')
+                if digest != hash_data(fingerprint):
+                    return None
+                value = file.read()
+            if self.max_bytes is not None:
+                # Entries are pruned in order of modification time.
+                os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def set(self, key: str, fingerprint: Any, value: bytes) -> None:
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(hash_data(fingerprint).encode('ascii') + b'\n')
+                file.write(value)
+            os.replace(temp_path, path)
+        except OSError:
+            # The cache is only an optimization, so never fail a render because of it.
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def prune(self) -> None:
+        """
+        Remove the least recently used entries, until the cache fits within `max_bytes`.
+        """
+        if self.max_bytes is None:
+            return
+        entries = []
+        with os.scandir(self._directory) as scan:
+            for entry in scan:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
@@ -0,0 +1,43 @@
+from typing import Optional
+import gzip
+
+import flask
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+# Supported content encodings, in order of preference,
+# along with the file extension used for precompressed variants.
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+# Only text based content benefits from compression.
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.xml', '.txt')
+
+
+def available_encodings() -> list[str]:
+    return [encoding for encoding in ENCODINGS if encoding != 'br' or brotli is not None]
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        assert brotli is not None
+        return brotli.compress(data)
+    # Use a fixed mtime in the gzip header, so that the output is deterministic.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def negotiate_encoding(request: flask.Request) -> Optional[str]:
+    """
+    Return the preferred content encoding that the client accepts, if any.
+    """
+    return request.accept_encodings.best_match(available_encodings())
+
+
+def is_compressible(path: str) -> bool:
+    return path.endswith(COMPRESSIBLE_EXTENSIONS)
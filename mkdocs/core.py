@@ -1,28 +1,84 @@
-from .handlers.base import Handler
-from .handlers.files import StaticFilesHandler
-from .handlers.navigation import NavigationHandler
-from .handlers.pages import PagesHandler
+from .profile import Profiler, current_profiler, peak_memory, phase, profiling
 from .site import Site
-from .utils import merge_dict, load_yaml
+from .utils import DocsScan, IgnoreRules, merge_dict, load_yaml
 
-from typing import Optional, List
+from typing import TYPE_CHECKING, Any, Callable, Optional, List
 import click
-import flask
+import json
 import os
+import threading
+import time
+
+# Flask, Jinja, Markdown and the handlers are slow to import, so they are
+# only imported by the commands that need them. Eg. 'mkdocs --help' doesn't.
+if TYPE_CHECKING:
+    import flask
+    from .handlers.base import Handler
+    from .output import Output
+    from .watch import Reloader
 
 
 DIRECTORY = os.path.dirname(__file__)
 
 DEFAULT_CONFIG = {
     'site_name': '',
+    # Gitignore-style patterns for files in the docs directory to leave out of the site.
+    # Hidden files and directories are always left out.
+    'exclude_docs': [],
     'build': {
         'url': '/',
+        # Write the site to this directory, or to an archive: '.zip', '.tar', '.tar.gz', '.tar.bz2' or '.tar.xz'.
+        # Defaults to the build directory.
+        'output': None,
+        'jobs': 1,
+        'clean': False,
+        # Release per-page data as soon as each page is written, for very large sites.
+        'low_memory': False,
+        # Write a '.fragment.html' alongside each page, with only the parts that change between pages.
+        'fragments': True,
+        'compress': False,
+        'statics': {
+            'compare': 'mtime',
+            'method': 'copy',
+        },
+        'search': {
+            'enabled': True,
+            'shard_size': 1000,
+        },
+        'manifest': '.mkdocs-manifest.json',
+        # The maximum size of rendered template fragments to keep, when building or serving.
+        'fragment_cache_size': 16 * 1024 * 1024,
+        # The maximum size of converted markdown to keep on disk, between builds and restarts.
+        'markdown_cache_size': 128 * 1024 * 1024,
+        # Highlight code blocks when rendering, with Pygments, rather than in the browser with highlight.js.
+        # Requires Pygments, from the 'highlight' extra.
+        'highlight': False,
+        # The maximum size of highlighted code blocks to keep, when building or serving.
+        'highlight_cache_size': 8 * 1024 * 1024,
     },
     'directories': {
         'docs': 'docs',
         'statics': os.path.join(DIRECTORY, 'statics'),
         'templates': os.path.join(DIRECTORY, 'templates'),
-        'build': 'site'
+        'build': 'site',
+        'cache': '.mkdocs-cache',
+    },
+    'serve': {
+        # The address to serve on, as 'host:port'.
+        'dev_addr': '127.0.0.1:5000',
+        'cache_size': 64 * 1024 * 1024,
+        'warm': False,
+        'static_cache_size': 16 * 1024 * 1024,
+        'static_cache_file_size': 1024 * 1024,
+        'compress': True,
+        'reload': False,
+        'search': True,
+        'stream': False,
+        # Share rendered pages between processes, through the cache directory.
+        'shared_cache': False,
+        # Add a 'Server-Timing' header to responses, with the time spent in each phase.
+        # On by default for 'mkdocs serve', but not for apps from `create_app()`.
+        'timing': False,
     },
     'context': {},
 }
@@ -30,62 +86,430 @@ DEFAULT_CONFIG = {
 
 class MkDocs:
     def __init__(self, config: dict) -> None:
+        from .output import is_archive
+
         config = merge_dict(DEFAULT_CONFIG, config)
+        output = config['build']['output']
+        self._archive = output is not None and is_archive(output)
+        if self._archive:
+            # Archives are written from scratch, so there is no previous build to compare against.
+            config = merge_dict(config, {'build': {'clean': True, 'manifest': None}})
+        elif output is not None:
+            config = merge_dict(config, {'directories': {'build': output}})
+        self._config = config
+        self._jobs = config['build']['jobs']
         self._url = config['build']['url']
         self._name = config['site_name']
         self._context = config['context']
+        self._timing = config['serve']['timing']
+        self._docs_scan = DocsScan(config['directories']['docs'], IgnoreRules(config['exclude_docs']))
         self._handlers = self.setup_handlers(config)
 
-    def setup_handlers(self, config: dict) -> List[Handler]:
+    def setup_handlers(self, config: dict) -> List["Handler"]:
+        from .handlers.compression import CompressionHandler
+        from .handlers.files import StaticFilesHandler
+        from .handlers.navigation import NavigationHandler
+        from .handlers.pages import PagesHandler
+        from .handlers.search import SearchHandler
+
+        pages = PagesHandler(config, self._docs_scan)
         return [
-            StaticFilesHandler(config),
-            PagesHandler(config),
-            NavigationHandler(config)
+            StaticFilesHandler(config, self._docs_scan),
+            pages,
+            NavigationHandler(config),
+            SearchHandler(config, pages),
+            CompressionHandler(config),
         ]
 
     def initialize(self) -> Site:
         site = Site(url=self._url, name=self._name, context=self._context)
-        for handler in self._handlers:
-            handler.initialize(site)
+        # Scan the docs directory once, for both pages and static files.
+        with phase('scan'):
+            self._docs_scan.scan()
+        try:
+            for handler in self._handlers:
+                with phase(f'{type(handler).__name__}.initialize', category='handler'):
+                    handler.initialize(site)
+        finally:
+            self._docs_scan.clear()
         return site
 
     def build(self, site: Site) -> None:
+        from .output import writing
+
+        with self._open_output() as output, writing(output):
+            self._build(site, output)
+
+    def _open_output(self) -> "Output":
+        from .compression import available_encodings
+        from .output import open_output
+
+        build = self._config['build']
+        return open_output(
+            build['output'] or self._config['directories']['build'],
+            method=build['statics']['method'],
+            encodings=available_encodings() if build['compress'] else [],
+        )
+
+    def _build(self, site: Site, output: "Output") -> None:
+        if self._jobs <= 1:
+            for handler in self._handlers:
+                with phase(f'{type(handler).__name__}.build', category='handler'):
+                    handler.build(site)
+            return
+
+        # Workers record phases in their own process, and send them back with their results.
+        # Workers can't write to archives, so they also send back anything written.
+        profiler = current_profiler()
+
+        from concurrent.futures import ProcessPoolExecutor
+        from .output import replay
+
+        # Each worker process initializes its own copy of the site from the config,
+        # rather than receiving a pickled copy of the (deeply linked) site model.
+        with ProcessPoolExecutor(
+            max_workers=self._jobs,
+            initializer=_initialize_worker,
+            initargs=(self._config,)
+        ) as executor:
+            for index, handler in enumerate(self._handlers):
+                with phase(f'{type(handler).__name__}.build', category='handler'):
+                    keys = handler.build_tasks(site)
+                    if keys is None:
+                        handler.build(site)
+                        continue
+
+                    # Send tasks in batches, to keep the inter-process overhead low,
+                    # and collect the results in order so that the output is deterministic.
+                    batches = _batched(keys, max(1, len(keys) // (self._jobs * 4)))
+                    results = {}
+                    outcomes = executor.map(
+                        _run_worker_tasks,
+                        [index] * len(batches),
+                        batches,
+                        [profiler is not None] * len(batches),
+                    )
+                    for batch, (batch_results, spans, writes) in zip(batches, outcomes):
+                        results.update(zip(batch, batch_results))
+                        if profiler is not None:
+                            profiler.extend(spans)
+                        replay(writes, output)
+                    handler.collect(site, results)
+
+    def serve(self, site: Site, url: str) -> Optional["flask.Response"]:
+        if not self._timing:
+            return self._serve(site, url)
+
+        start = time.perf_counter()
+        with profiling(Profiler()) as profiler:
+            response = self._serve(site, url)
+        if response is not None:
+            # Streamed responses only include the phases before the first chunk.
+            response.headers['Server-Timing'] = profiler.server_timing(time.perf_counter() - start)
+        return response
+
+    def warm(self, site: Site) -> None:
         for handler in self._handlers:
-            handler.build(site)
+            handler.warm(site)
 
-    def serve(self, site: Site, url: str) -> Optional[flask.Response]:
+    def watched_paths(self) -> list[str]:
+        directories = self._config['directories']
+        return [directories['docs'], directories['statics'], directories['templates']]
+
+    def update(self, site: Site, paths: set[str]) -> None:
+        for handler in self._handlers:
+            handler.update(site, paths)
+
+    def _serve(self, site: Site, url: str) -> Optional["flask.Response"]:
         for handler in self._handlers:
             response = handler.serve(site, url)
             if response is not None:
                 return response
 
+    def reconfigure(self, site: Site, config: dict) -> None:
+        """
+        Apply a changed config to an initialized site.
 
-@click.group()
-def cli():
-    pass
+        Changes to the site name, context and navigation are applied in place.
+        Other settings, such as directories, only take effect on restart.
+        """
+        config = merge_dict(DEFAULT_CONFIG, config)
+        site.name = self._name = config['site_name']
+        site.context = self._context = config['context']
+        for handler in self._handlers:
+            handler.reconfigure(site, config)
 
-@cli.command()
-def build():
-    config = load_yaml("mkdocs.yml")
-    md = MkDocs(config)
-    site = md.initialize()
-    md.build(site)
 
-@cli.command()
-def serve():
-    config = load_yaml("mkdocs.yml")
-    md = MkDocs(config)
-    site = md.initialize()
+# Parallel build workers...
+
+_worker: Optional[tuple[MkDocs, Site, Optional["Output"]]] = None
+
+
+def _initialize_worker(config: dict) -> None:
+    global _worker
+
+    mkdocs = MkDocs(config)
+    # Archives can only be written by the main process.
+    output = None if mkdocs._archive else mkdocs._open_output()
+    _worker = (mkdocs, mkdocs.initialize(), output)
+
+
+def _run_worker_tasks(index: int, keys: list[str], profile: bool) -> tuple[list[Any], list, list]:
+    from .output import BufferedOutput, writing
+
+    assert _worker is not None
+    mkdocs, site, output = _worker
+    handler = mkdocs._handlers[index]
+    buffered = BufferedOutput()
+    with writing(output or buffered):
+        if not profile:
+            return [handler.build_task(site, key) for key in keys], [], buffered.writes
+        with profiling(Profiler()) as profiler:
+            results = [handler.build_task(site, key) for key in keys]
+    return results, profiler.spans, buffered.writes
+
+
+class _BackgroundSite:
+    """
+    Creates and initializes the site on a background thread,
+    so that the server can start accepting requests straight away.
+
+    Requests wait until the site is ready. `on_created` is called
+    before the site is initialized, eg. to start watching for changes.
+    """
+
+    def __init__(self, config: dict, on_created: Optional[Callable[[MkDocs], None]] = None) -> None:
+        self._config = config
+        self._on_created = on_created
+        self._ready = threading.Event()
+        self._result: Optional[tuple[MkDocs, Site]] = None
+        self._error: Optional[BaseException] = None
+        threading.Thread(target=self._initialize, daemon=True).start()
+
+    def get(self) -> tuple[MkDocs, Site]:
+        self._ready.wait()
+        if self._error is not None:
+            raise RuntimeError('Failed to initialize the site') from self._error
+        assert self._result is not None
+        return self._result
+
+    def _initialize(self) -> None:
+        try:
+            md = MkDocs(self._config)
+            if self._on_created is not None:
+                self._on_created(md)
+            site = md.initialize()
+            md.warm(site)
+            self._result = (md, site)
+        except BaseException as exc:
+            self._error = exc
+        finally:
+            self._ready.set()
+
+
+class _InitializedSite:
+    """
+    A site which is initialized up front, eg. before a prefork server
+    forks its workers, so that every worker shares the initialized site.
+
+    Threads don't survive a fork, so any background work is only started
+    by the first request in each process.
+    """
+
+    def __init__(self, config: dict) -> None:
+        self._md = MkDocs(config)
+        self._site = self._md.initialize()
+        self._warmed: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> tuple[MkDocs, Site]:
+        with self._lock:
+            if self._warmed != os.getpid():
+                self._md.warm(self._site)
+                self._warmed = os.getpid()
+        return self._md, self._site
+
+
+def create_app(config: Optional[dict] = None) -> "flask.Flask":
+    """
+    Return a WSGI application that serves the site, for running under a
+    production server. The config is loaded from 'mkdocs.yml' if not given.
+
+    The site is initialized before returning, so with a prefork server that
+    loads the application before forking, it is only initialized once:
+
+    ```
+    gunicorn --preload --workers 4 'mkdocs:create_app()'
+    ```
+
+    Changes to the docs aren't watched for. Set `serve.shared_cache` to
+    share rendered pages between the workers.
+    """
+    if config is None:
+        config = load_yaml('mkdocs.yml')
+    config = merge_dict(config, {'serve': {'reload': False}})
+    return _make_app(_InitializedSite(config).get)
+
+
+def _make_app(get_site: Callable[[], tuple[MkDocs, Site]], reloader: Optional["Reloader"] = None) -> "flask.Flask":
+    import flask
 
     app = flask.Flask(__name__)
 
+    if reloader is not None:
+        from .watch import RELOAD_URL
+
+        @app.route(RELOAD_URL)
+        def events():
+            return flask.Response(reloader.stream(), mimetype='text/event-stream')
+
     @app.route('/')
     @app.route('/<path:path>')
     def endpoint(path=''):
         url = f'/{path}'
+        md, site = get_site()
         response = md.serve(site, url)
         if response is None:
             flask.abort(404)
         return response
 
-    app.run()
+    return app
+
+
+def _serve_workers(app: "flask.Flask", workers: int, host: str, port: int) -> None:
+    """
+    Serve the app from several forked worker processes, which all accept
+    connections from the same listening socket.
+    """
+    import signal
+    import socket
+    from werkzeug.serving import make_server
+
+    if not hasattr(os, 'fork'):
+        raise click.ClickException("'--workers' is not supported on this platform, which can't fork processes.")
+
+    listener = socket.create_server((host, port))
+    click.echo(f'Serving on http://{host}:{port}/ with {workers} workers')
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    # Stop the workers when the server is either interrupted or terminated.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for pid in pids:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        for pid in pids:
+            os.waitpid(pid, 0)
+
+
+def _batched(items: list[str], size: int) -> list[list[str]]:
+    return [items[idx:idx + size] for idx in range(0, len(items), size)]
+
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.option('--jobs', '-j', type=int, default=None, help='Number of worker processes. Use 0 for one per CPU.')
+@click.option('--output', '-o', default=None, help='Write the site to this directory, or to a .zip or .tar(.gz|.bz2|.xz) archive.')
+@click.option('--clean', is_flag=True, help='Rebuild every output, rather than only those which have changed.')
+@click.option('--compress', is_flag=True, help='Write precompressed gzip and brotli variants of text outputs.')
+@click.option('--low-memory', is_flag=True, help='Keep as little of the site in memory as possible.')
+@click.option('--profile', is_flag=True, help='Report the slowest pages and phases of the build.')
+@click.option('--trace', default=None, help='Write a trace of the build phases to this JSON file.')
+def build(
+    jobs: Optional[int], output: Optional[str], clean: bool, compress: bool, low_memory: bool,
+    profile: bool, trace: Optional[str],
+):
+    config = load_yaml("mkdocs.yml")
+    if jobs is not None:
+        config = merge_dict(config, {'build': {'jobs': jobs or os.cpu_count() or 1}})
+    if output is not None:
+        config = merge_dict(config, {'build': {'output': output}})
+    if clean:
+        config = merge_dict(config, {'build': {'clean': True}})
+    if compress:
+        config = merge_dict(config, {'build': {'compress': True}})
+    if low_memory:
+        config = merge_dict(config, {'build': {'low_memory': True}})
+    md = MkDocs(config)
+    if not (profile or trace):
+        site = md.initialize()
+        md.build(site)
+        _report_memory(md._jobs)
+        return
+
+    with profiling(Profiler()) as profiler:
+        site = md.initialize()
+        md.build(site)
+    if profile:
+        click.echo(profiler.report())
+    _report_memory(md._jobs)
+    if trace:
+        with open(trace, 'w') as output_file:
+            json.dump(profiler.trace_events(), output_file)
+
+def _report_memory(jobs: int) -> None:
+    memory = peak_memory()
+    if memory is not None:
+        own, workers = memory
+        summary = f'Peak memory: {own / 1024 / 1024:.1f} MB'
+        # Any other child processes are counted too, so only report workers if the build used them.
+        if jobs > 1 and workers:
+            summary += f' (largest worker: {workers / 1024 / 1024:.1f} MB)'
+        click.echo(summary)
+
+@cli.command()
+@click.option('--warm', is_flag=True, help='Pre-render pages in the background after starting.')
+@click.option('--watch/--no-watch', default=True, help='Watch for changes, and reload open pages.')
+@click.option('--stream', is_flag=True, help='Send pages as they are rendered.')
+@click.option('--workers', type=int, default=1, help='Number of worker processes. Implies --no-watch when more than one.')
+@click.option('--dev-addr', '-a', default=None, metavar='<IP:PORT>', help='The address to serve on. Defaults to 127.0.0.1:5000.')
+def serve(warm: bool, watch: bool, stream: bool, workers: int, dev_addr: Optional[str]):
+    config_path = os.path.abspath("mkdocs.yml")
+    config = merge_dict({'serve': {'timing': True}}, load_yaml(config_path))
+    if dev_addr is not None:
+        config = merge_dict(config, {'serve': {'dev_addr': dev_addr}})
+    host, _, port = merge_dict(DEFAULT_CONFIG, config)['serve']['dev_addr'].rpartition(':')
+    if warm:
+        config = merge_dict(config, {'serve': {'warm': True}})
+    if stream:
+        config = merge_dict(config, {'serve': {'stream': True}})
+
+    if workers > 1:
+        # Initialize the site once, before forking, and share rendered pages between the workers.
+        config = merge_dict(config, {'serve': {'shared_cache': True}})
+        _serve_workers(create_app(config), workers, host, int(port))
+        return
+
+    config = merge_dict(config, {'serve': {'reload': watch}})
+
+    from .watch import Reloader, Watcher
+
+    reloader = Reloader()
+
+    def on_change(paths: set[str]) -> None:
+        md, site = background.get()
+        if config_path in paths:
+            md.reconfigure(site, load_yaml(config_path))
+        md.update(site, paths)
+        reloader.notify()
+
+    def start_watching(md: MkDocs) -> None:
+        # Start before the site is initialized, so that no changes are missed.
+        Watcher(md.watched_paths() + [config_path], on_change).start()
+
+    background = _BackgroundSite(config, on_created=start_watching if watch else None)
+    app = _make_app(background.get, reloader if watch else None)
+    app.run(host, int(port), threaded=True)
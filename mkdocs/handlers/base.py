@@ -1,4 +1,5 @@
 from ..site import Site
+from typing import Any, Optional
 import flask
 
 
@@ -7,7 +8,48 @@ class Handler:
         pass
 
     def build(self, site: Site) -> None:
-        pass
+        keys = self.build_tasks(site)
+        if keys is not None:
+            self.collect(site, {key: self.build_task(site, key) for key in keys})
 
     def serve(self, site: Site, url: str) -> flask.Response:
         pass
+
+    def update(self, site: Site, paths: set[str]) -> None:
+        """
+        Called by the development server when files have been added,
+        modified or removed, so that handlers can update the site in place.
+        """
+        pass
+
+    def reconfigure(self, site: Site, config: dict) -> None:
+        """
+        Called by the development server when the config file has changed.
+        """
+        pass
+
+    def warm(self, site: Site) -> None:
+        """
+        Called once the development server has started, so that handlers
+        can do any background work ahead of the first request.
+        """
+        pass
+
+    # Task based builds...
+    #
+    # Handlers can split their build into independent units of work,
+    # by returning a key for each unit that needs building from `build_tasks()`.
+    # Each task is run with `build_task()`, which may happen inside a worker
+    # process against that worker's own copy of the site. Once every task has
+    # run, the results are passed back to `collect()` in the main process.
+    #
+    # Handlers that return `None` from `build_tasks()` are built with `build()`.
+
+    def build_tasks(self, site: Site) -> Optional[list[str]]:
+        return None
+
+    def build_task(self, site: Site, key: str) -> Any:
+        pass
+
+    def collect(self, site: Site, results: dict[str, Any]) -> None:
+        pass
@@ -0,0 +1,149 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from .base import Handler
+from ..compression import ENCODINGS, available_encodings, compress, is_compressible
+from ..manifest import Manifest
+from ..output import current_output
+from ..site import Site
+from ..utils import list_files_within_directory
+
+import flask
+
+
+class CompressionHandler(Handler):
+    """
+    Writes precompressed '.gz' and '.br' variants of the text based build
+    outputs, for web servers and CDNs that can serve them directly.
+
+    Runs after the other handlers have written their output, and only
+    recompresses outputs which have been modified since the last build.
+    Archives are written with their compressed variants included, so
+    this only applies to builds into a directory.
+
+    The variants that it writes are recorded in the manifest, and only
+    those are ever replaced or removed. Precompressed files copied from
+    the docs or statics, such as 'downloads/data.csv.gz', are left as they are.
+    """
+
+    def __init__(self, config: dict) -> None:
+        self._enabled = config['build']['compress']
+        self._build_dir = config['directories']['build']
+        self._manifest_path = config['build']['manifest']
+        self._clean = config['build']['clean']
+        self._encodings = available_encodings()
+        self._manifest: Optional[Manifest] = None
+
+    def build(self, site: Site) -> None:
+        # zlib and brotli release the GIL while compressing,
+        # so threads are enough to compress outputs in parallel.
+        keys = self.build_tasks(site)
+        with ThreadPoolExecutor() as executor:
+            results = dict(zip(keys, executor.map(lambda key: self.build_task(site, key), keys)))
+        self.collect(site, results)
+
+    def serve(self, site: Site, url: str) -> Optional[flask.Response]:
+        pass
+
+    def build_tasks(self, site: Site) -> list[str]:
+        if not self._enabled or not current_output().incremental:
+            return []
+
+        # Unlike other handlers, the manifest is kept on clean builds, since it
+        # records which of the existing files in the build directory are ours.
+        manifest = Manifest(self._manifest_path, 'compression')
+        self._manifest = manifest
+        outputs = set(list_files_within_directory(self._build_dir))
+        suffixes = tuple(ENCODINGS.values())
+
+        if not len(manifest):
+            # Adopt variants from builds before they were recorded,
+            # unless they were copied from the docs or statics.
+            for path in outputs:
+                if path.endswith(suffixes) and site.files.lookup_path(path) is None:
+                    stat = os.stat(os.path.join(self._build_dir, path))
+                    manifest.set(path, {'source': os.path.splitext(path)[0], 'stat': [stat.st_mtime_ns, stat.st_size]})
+
+        for path in manifest:
+            # Remove any variants of outputs that no longer exist, and forget any
+            # that have since been replaced by a file from the docs or statics.
+            generated = self._is_generated(path)
+            if generated and manifest.get(path)['source'] not in outputs:
+                self._remove_variant(path)
+            if not generated or manifest.get(path)['source'] not in outputs:
+                manifest.remove(path)
+        # Save now, so that build workers see the same variants as ours.
+        manifest.save()
+
+        return [
+            path for path in outputs
+            if not path.endswith(suffixes) and is_compressible(path) and self._is_stale(path)
+        ]
+
+    def build_task(self, site: Site, key: str) -> dict[str, list[int]]:
+        output_path = os.path.join(self._build_dir, key)
+        with open(output_path, 'rb') as input_file:
+            content = input_file.read()
+
+        written = {}
+        for encoding in self._encodings:
+            path = key + ENCODINGS[encoding]
+            compressed_path = os.path.join(self._build_dir, path)
+            if os.path.exists(compressed_path) and not self._is_generated(path):
+                continue
+            # Replace the variant rather than writing to it, since it may have
+            # been linked to a file in the docs by an earlier build.
+            temp_path = compressed_path + '.tmp'
+            with open(temp_path, 'wb') as output_file:
+                output_file.write(compress(content, encoding))
+            os.replace(temp_path, compressed_path)
+            stat = os.stat(compressed_path)
+            written[path] = [stat.st_mtime_ns, stat.st_size]
+        return written
+
+    def collect(self, site: Site, results: dict[str, Any]) -> None:
+        if self._manifest is None:
+            return
+        for key, written in results.items():
+            for path, stat in written.items():
+                self._manifest.set(path, {'source': key, 'stat': stat})
+        self._manifest.save()
+        self._manifest = None
+
+    # ...
+
+    def _is_generated(self, path: str) -> bool:
+        """
+        Determine if a variant in the build directory was written by this handler,
+        and hasn't been replaced since.
+        """
+        if self._manifest is None:
+            # Build workers only read the manifest, once it has been saved by `build_tasks()`.
+            self._manifest = Manifest(self._manifest_path, 'compression')
+        entry = self._manifest.get(path)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(os.path.join(self._build_dir, path))
+        except OSError:
+            return False
+        return entry['stat'] == [stat.st_mtime_ns, stat.st_size]
+
+    def _is_stale(self, path: str) -> bool:
+        mtime = os.stat(os.path.join(self._build_dir, path)).st_mtime_ns
+        for encoding in self._encodings:
+            compressed_path = os.path.join(self._build_dir, path + ENCODINGS[encoding])
+            if not os.path.exists(compressed_path):
+                return True
+            if self._is_generated(path + ENCODINGS[encoding]):
+                if self._clean or os.stat(compressed_path).st_mtime_ns < mtime:
+                    return True
+        return False
+
+    def _remove_variant(self, path: str) -> None:
+        compressed_path = os.path.join(self._build_dir, path)
+        os.remove(compressed_path)
+        directory = os.path.dirname(compressed_path)
+        if directory != self._build_dir.rstrip(os.sep) and not os.listdir(directory):
+            os.rmdir(directory)
@@ -1,33 +1,165 @@
+import mimetypes
 import os
-import shutil
-from typing import List, Optional
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, List, Optional
 
 from .base import Handler
+from ..cache import LRUCache
+from ..compression import compress, is_compressible, negotiate_encoding
+from ..manifest import Manifest
+from ..output import current_output
+from ..profile import phase
 from ..site import File, Files, Site
-from ..utils import list_files_within_directory, url_for_path
+from ..utils import DocsScan, IgnoreRules, hash_file, is_markdown, path_within_directory, scan_directory, url_for_path
 
 import flask
 
 
+@dataclass
+class _FileInfo:
+    """
+    HTTP validators and metadata for a static file, computed from its stat result.
+    """
+    etag: str
+    last_modified: datetime
+    size: int
+    mimetype: str
+
+    @classmethod
+    def from_stat(cls, path: str, stat: os.stat_result) -> "_FileInfo":
+        mimetype, _ = mimetypes.guess_type(path)
+        return cls(
+            etag=f'{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}',
+            last_modified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+            size=stat.st_size,
+            mimetype=mimetype or 'application/octet-stream',
+        )
+
+
 class StaticFilesHandler(Handler):
-    def __init__(self, config: dict) -> None:
+    """
+    Copies or serves the theme's static files, along with any files in the
+    docs directory which aren't markdown, such as images. Files in the docs
+    directory take precedence over theme files with the same path.
+    """
+
+    def __init__(self, config: dict, docs_scan: DocsScan) -> None:
         self._base_url = config['build']['url']
         self._statics_dir = config['directories']['statics']
+        self._docs_dir = config['directories']['docs']
+        self._docs_scan = docs_scan
+        self._ignore = docs_scan.ignore
         self._build_dir = config['directories']['build']
+        self._manifest_path = config['build']['manifest']
+        self._clean = config['build']['clean']
+        # How to detect unchanged files: 'mtime' compares size and modification time,
+        # and 'hash' compares content hashes with those in the manifest.
+        self._compare = config['build']['statics']['compare']
+
+        # The source of each static file, by its path within the site.
+        self._sources: dict[str, str] = {}
+
+        # State for the build in progress, in the main process.
+        self._manifest: Optional[Manifest] = None
+        self._inputs: dict[str, dict] = {}
+        self._removed = 0
+
+        # Precomputed HTTP validators for 'mkdocs serve', and the contents
+        # of any small files that have been served, in one or more encodings.
+        self._info: dict[str, _FileInfo] = {}
+        self._contents: LRUCache[dict[Optional[str], bytes]] = LRUCache(config['serve']['static_cache_size'])
+        self._max_cached_file_size = config['serve']['static_cache_file_size']
+        self._compress = config['serve']['compress']
 
     def initialize(self, site: Site):
-        files = []
-        for path in list_files_within_directory(self._statics_dir):
-            url = url_for_path(path, base_url=self._base_url)
-            file = File(url=url, path=path)
-            files.append(file)
+        self._sources = {}
+        self._info = {}
+        # Files in the docs directory replace any theme files with the same path.
+        statics = scan_directory(self._statics_dir, IgnoreRules())
+        for directory, scanned in ((self._statics_dir, statics), (self._docs_dir, self._docs_scan.files)):
+            for path, stat in scanned:
+                self._sources[path] = os.path.join(directory, path)
+                self._info[path] = _FileInfo.from_stat(path, stat)
 
+        files = [File(url=url_for_path(path, base_url=self._base_url), path=path) for path in self._sources]
         files = sorted(files, key=lambda file: file.url)
         site.files = Files(files)
 
-    def build(self, site: Site) -> None:
+    def update(self, site: Site, paths: set[str]) -> None:
+        for changed in paths:
+            path = path_within_directory(changed, self._docs_dir)
+            if path is not None:
+                if is_markdown(path) or self._ignore.ignores(path):
+                    continue
+            else:
+                path = path_within_directory(changed, self._statics_dir)
+                if path is None or IgnoreRules().ignores(path):
+                    continue
+
+            source = self._find_source(path)
+            existing = site.files.lookup_path(path)
+            if source is not None:
+                self._sources[path] = source
+                if existing is None:
+                    url = url_for_path(path, base_url=self._base_url)
+                    site.files.add(File(url=url, path=path))
+            else:
+                self._sources.pop(path, None)
+                if existing is not None:
+                    site.files.remove(existing)
+            self._update_info(path)
+
+    def build_tasks(self, site: Site) -> list[str]:
+        """
+        Return the files that need copying, skipping any whose output is already identical.
+        """
+        manifest = Manifest(self._manifest_path, 'files', clean=self._clean)
+
+        keys = []
+        self._manifest = manifest
+        self._inputs = {}
         for file in site.files:
-            self._build_file(file)
+            source = self._sources[file.path]
+            output_path = os.path.join(self._build_dir, file.path)
+            if self._compare == 'hash':
+                with phase('hash'):
+                    inputs = {'source': file.path, 'hash': hash_file(source)}
+                unchanged = manifest.get(file.path) == inputs and os.path.exists(output_path)
+            else:
+                inputs = {'source': file.path}
+                unchanged = not self._clean and self._is_identical(source, output_path)
+            self._inputs[file.path] = inputs
+            if not unchanged:
+                keys.append(file.path)
+
+        # Remove any files that no longer exist.
+        self._removed = 0
+        for path in manifest:
+            if site.files.lookup_path(path) is None:
+                output_path = os.path.join(self._build_dir, path)
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                    self._removed += 1
+                manifest.remove(path)
+
+        return keys
+
+    def build_task(self, site: Site, key: str) -> None:
+        with phase('copy'):
+            # Written with the 'build.statics.method' setting, see `DirectoryOutput`.
+            current_output().copy(self._sources[key], key)
+
+    def collect(self, site: Site, results: dict[str, Any]) -> None:
+        assert self._manifest is not None
+        for file in site.files:
+            self._manifest.set(file.path, self._inputs[file.path])
+        self._manifest.save()
+        self._manifest = None
+        self._inputs = {}
+
+        unchanged = len(site.files) - len(results)
+        print(f'Copied {len(results)} static files ({unchanged} unchanged, {self._removed} removed)')
 
     def serve(self, site: Site, url: str) -> Optional[flask.Response]:
         file = site.files.lookup_url(url)
@@ -36,20 +168,73 @@ class StaticFilesHandler(Handler):
 
     # ...
 
-    def _build_file(self, file: File) -> None:
-        source = os.path.join(self._statics_dir, file.path)
-        path = os.path.join(self._build_dir, file.path)
+    def _is_identical(self, source: str, path: str) -> bool:
+        try:
+            source_stat = os.stat(source)
+            output_stat = os.stat(path)
+        except OSError:
+            return False
+        return (
+            source_stat.st_size == output_stat.st_size and
+            source_stat.st_mtime_ns == output_stat.st_mtime_ns
+        )
 
-        print(f'Copy {source!r} -> {path!r}')
-        self._make_parent_directories(path)
-        shutil.copy(source, path)
+    def _find_source(self, path: str) -> Optional[str]:
+        for directory in (self._docs_dir, self._statics_dir):
+            source = os.path.join(directory, path)
+            if os.path.isfile(source):
+                return source
+        return None
 
-    def _make_parent_directories(self, path: str) -> None:
-        """
-        Create all parent directories to the given path, if they do not yet exist.
-        """
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+    def _update_info(self, path: str) -> None:
+        try:
+            self._info[path] = _FileInfo.from_stat(path, os.stat(self._sources[path]))
+        except (KeyError, OSError):
+            self._info.pop(path, None)
+        self._contents.discard(path)
 
     def _serve_file(self, file: File) -> flask.Response:
-        source = os.path.join(self._statics_dir, file.path)
-        return flask.send_file(source)
+        source = self._sources[file.path]
+        info = self._info.get(file.path)
+        if info is None:
+            self._update_info(file.path)
+            info = self._info[file.path]
+
+        if info.size > self._max_cached_file_size:
+            response = flask.send_file(
+                source,
+                mimetype=info.mimetype,
+                etag=info.etag,
+                last_modified=info.last_modified,
+                conditional=True,
+            )
+        else:
+            compressible = self._compress and is_compressible(file.path)
+            encoding = negotiate_encoding(flask.request) if compressible else None
+
+            variants = self._contents.get(file.path, info.etag)
+            if variants is None:
+                with phase('read'), open(source, 'rb') as input_file:
+                    variants = {None: input_file.read()}
+                self._contents.set(file.path, info.etag, variants, len(variants[None]))
+            if encoding not in variants:
+                # Compress each file once per encoding, rather than on every request.
+                with phase('compress'):
+                    variants = {**variants, encoding: compress(variants[None], encoding)}
+                self._contents.set(file.path, info.etag, variants, sum(map(len, variants.values())))
+            content = variants[encoding]
+
+            # Handles 'If-None-Match', 'If-Modified-Since' and 'Range' requests.
+            # Each encoding is a different representation, so needs a different ETag.
+            response = flask.Response(content, mimetype=info.mimetype)
+            response.set_etag(info.etag if encoding is None else f'{info.etag}-{encoding}')
+            response.last_modified = info.last_modified
+            if compressible:
+                response.vary.add('Accept-Encoding')
+            if encoding is not None:
+                response.content_encoding = encoding
+            response.make_conditional(flask.request, accept_ranges=True, complete_length=len(content))
+
+        # Files may change while serving, so always have browsers revalidate.
+        response.cache_control.no_cache = True
+        return response
@@ -1,16 +1,25 @@
 from .base import Handler
-from ..site import Navigation, NavItem, Pages, Site
-from typing import List, Optional, Tuple
+from ..site import Navigation, NavItem, Page, Pages, Site
+from typing import Iterator, List, Optional, Tuple
 import flask
 
 
 class NavigationHandler(Handler):
     def __init__(self, config: dict) -> None:
         self._nav_config = config["nav"]
+        # The pages referenced by the navigation, when it was last loaded.
+        self._linked: dict[str, Optional[Page]] = {}
 
     def initialize(self, site: Site) -> None:
+        # Clear any links back from pages to a previously loaded navigation.
+        for page in site.pages:
+            page.navigation = None
         nav_items, _ = self._load_navigation(self._nav_config, site.pages)
         site.navigation = Navigation(nav_items)
+        self._linked = {
+            path: site.pages.lookup_path(path)
+            for path in self._referenced_paths(self._nav_config)
+        }
 
     def build(self, site: Site) -> None:
         pass
@@ -18,8 +27,26 @@ class NavigationHandler(Handler):
     def serve(self, site: Site, url: str) -> Optional[flask.Response]:
         pass
 
+    def update(self, site: Site, paths: set[str]) -> None:
+        # Reload the navigation if any of the pages it references have been added or removed.
+        if any(site.pages.lookup_path(path) is not page for path, page in self._linked.items()):
+            self.initialize(site)
+
+    def reconfigure(self, site: Site, config: dict) -> None:
+        if config["nav"] != self._nav_config:
+            self._nav_config = config["nav"]
+            self.initialize(site)
+
     # ...
 
+    def _referenced_paths(self, config: list) -> Iterator[str]:
+        for item in config:
+            for value in item.values():
+                if isinstance(value, list):
+                    yield from self._referenced_paths(value)
+                elif isinstance(value, str):
+                    yield value
+
     def _load_navigation(
         self,
         config: list,
@@ -1,88 +1,535 @@
+import html
+import json
 import os
+import re
+import threading
+import urllib.parse
+import uuid
 from contextlib import contextmanager
-from typing import Iterator, List, Optional
+from typing import Callable, Iterator, Optional, Tuple, Union
 
 
+import click
 import flask
 import jinja2
+import jinja2.ext
+import jinja2.meta
+import jinja2.nodes
 import markdown
+from markdown.extensions.attr_list import get_attrs_and_remainder
+from markdown.extensions.codehilite import parse_hl_lines
+from markdown.extensions.fenced_code import FencedBlockPreprocessor
 import markdown_gfm_admonition
 from mdx_linkify.mdx_linkify import LinkifyExtension
 import slugify
 import xml.etree.ElementTree as etree
 
-from ..site import Pages, Page, Section, Site
-from ..utils import list_files_within_directory, url_for_path
+from .base import Handler
+from ..cache import DiskCache, LRUCache
+from ..compression import compress, negotiate_encoding
+from ..manifest import Manifest
+from ..output import current_output
+from ..profile import phase
+from ..site import Navigation, NavItem, Pages, Page, PageView, Section, Site
+from ..watch import RELOAD_SCRIPT
+from ..utils import (
+    DocsScan, hash_data, hash_file, is_markdown, path_within_directory, url_for_path
+)
+
+try:
+    import pygments
+    import pygments.formatters
+    import pygments.lexers
+    import pygments.util
+except ImportError:  # pragma: no cover
+    pygments = None
 
 
 class BuildState:
+    """
+    The state for the page currently being rendered by a markdown environment.
+
+    Each markdown environment has its own state, so environments
+    must not be shared between concurrent renders.
+    """
+
     @contextmanager
     def active_page(self, page: Page) -> Iterator[None]:
         self.current_page = page
-        if page.navigation is not None:
-            for nav in page.navigation.breadcrumbs:
-                nav.is_active = True
+        self.sections: list[Section] = []
+        # The source paths referenced by links on the current page,
+        # mapped to the URL that each one resolved to.
+        self.links: dict[str, Optional[str]] = {}
+        # The anchors linked to, by the source path of the page they are on.
+        self.anchors: dict[str, list[str]] = {}
         try:
             yield
         finally:
             del(self.current_page)
-            if page.navigation is not None:
-                for nav in page.navigation.breadcrumbs:
-                    nav.is_active = False
 
 
-class PagesHandler:
-    def __init__(self, config: dict) -> None:
+class _MarkdownPool:
+    """
+    A pool of warm markdown environments, each with its own build state.
+
+    Markdown environments are not safe to share between concurrent renders,
+    but are expensive to set up, so we keep idle environments around and
+    reset them between uses.
+    """
+
+    def __init__(self, factory: Callable[[BuildState], markdown.Markdown]) -> None:
+        self._factory = factory
+        self._idle: list[Tuple[BuildState, markdown.Markdown]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self) -> Iterator[Tuple[BuildState, markdown.Markdown]]:
+        with self._lock:
+            env = self._idle.pop() if self._idle else None
+        if env is None:
+            state = BuildState()
+            env = (state, self._factory(state))
+        try:
+            yield env
+        finally:
+            env[1].reset()
+            with self._lock:
+                self._idle.append(env)
+
+
+class _LinkResolver:
+    """
+    Resolves the links written in markdown pages to the URLs that they reference.
+
+    Resolving a link only depends on the directory of the page that it is on,
+    so results are memoized by directory and link, and each distinct link
+    is only resolved once. The memo must be cleared whenever pages or
+    static files are added or removed.
+    """
+
+    def __init__(self, site: Site) -> None:
+        self._site = site
+        self._resolved: dict[Tuple[str, str], Tuple[str, Optional[str], Optional[str], str]] = {}
+
+    def resolve(self, directory: str, href: str) -> Tuple[str, Optional[str], Optional[str], str]:
+        """
+        Return the rewritten link, the referenced source path, the URL that
+        it resolved to, and the '#fragment'. The path is `None` for links
+        which are not to a source file, such as external links, and the URL
+        is `None` if the referenced page or static file does not exist.
+        """
+        key = (directory, href)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            resolved = self._resolved[key] = self._resolve(directory, href)
+        return resolved
+
+    def clear(self) -> None:
+        self._resolved.clear()
+
+    def _resolve(self, directory: str, href: str) -> Tuple[str, Optional[str], Optional[str], str]:
+        parts = urllib.parse.urlsplit(href)
+        if parts.scheme or parts.netloc or not parts.path:
+            # External links, and links within the current page, are left as they are.
+            return href, None, None, parts.fragment
+
+        path = urllib.parse.unquote(parts.path)
+        if path.startswith('/'):
+            referenced_path = os.path.normpath(path.lstrip('/'))
+        else:
+            referenced_path = os.path.normpath(os.path.join(directory, path))
+        referenced_url = _url_of_path(self._site, referenced_path)
+        if referenced_url is None:
+            # Leave broken links as they were written, so they can be found in the output.
+            return href, referenced_path, None, parts.fragment
+
+        url = referenced_url
+        if parts.query:
+            url += '?' + parts.query
+        if parts.fragment:
+            url += '#' + parts.fragment
+        return url, referenced_path, referenced_url, parts.fragment
+
+
+class _DeferredView:
+    """
+    Stands in for a `PageView` while a page is being streamed,
+    and only converts the page's markdown when the template first uses it.
+
+    This lets the head of the template be sent before the conversion,
+    which may take a while for very large pages.
+    """
+
+    def __init__(self, convert: Callable[[], PageView]) -> None:
+        self._convert = convert
+        self._view: Optional[PageView] = None
+
+    @property
+    def resolved(self) -> bool:
+        return self._view is not None
+
+    def resolve(self) -> PageView:
+        if self._view is None:
+            self._view = self._convert()
+        return self._view
+
+    def __getattr__(self, name: str):
+        return getattr(self.resolve(), name)
+
+
+class PagesHandler(Handler):
+    # Increment whenever the markdown extensions or processors change,
+    # since their output is cached on disk between builds.
+    MARKDOWN_VERSION = 2
+
+    # The blocks of 'base.html' that change from page to page. These are
+    # rendered on their own as the page's fragment, which 'base.js' swaps
+    # into place when following links, rather than loading the whole page.
+    FRAGMENT_BLOCKS = ('title', 'sidebar_state', 'toc', 'content')
+    FRAGMENT_SUFFIX = '.fragment.html'
+
+    def __init__(self, config: dict, docs_scan: DocsScan) -> None:
         self._base_url = config['build']['url']
         self._docs_dir = config['directories']['docs']
+        self._docs_scan = docs_scan
+        self._ignore = docs_scan.ignore
         self._templates_dir = config['directories']['templates']
         self._build_dir = config['directories']['build']
+        self._cache_dir = config['directories']['cache']
+        self._manifest_path = config['build']['manifest']
+        self._clean = config['build']['clean']
+        # The text of each page's sections is saved on disk, rather than in the manifest,
+        # for building the search index. With this, it is only kept on disk, rather
+        # than in memory too. See `load_section_texts()`.
+        self._low_memory = config['build']['low_memory']
+        # Write each page's fragment alongside it, eg. 'about/index.fragment.html'.
+        self._fragments = config['build']['fragments']
+
+        self._config_hash = self._hash_config(config)
+
+        # Environments for rendering pages, created once per process and site.
+        self._envs_site: Optional[Site] = None
+        self._template_env: Optional[jinja2.Environment] = None
+        self._markdown_envs: Optional[_MarkdownPool] = None
+        self._links: Optional[_LinkResolver] = None
+        self._envs_lock = threading.Lock()
+        # Rendered template fragments, from `{% cache %}` blocks,
+        # and the navigation that they were rendered with.
+        self._fragment_cache_size = config['build']['fragment_cache_size']
+        self._fragments_navigation: Optional[Navigation] = None
+        # Highlight code blocks with Pygments, rather than with highlight.js
+        # in the browser. Highlighted blocks are cached by language and code.
+        self._highlight = config['build']['highlight']
+        if self._highlight and pygments is None:
+            raise click.ClickException(
+                "'build.highlight' requires Pygments, install it with: pip install 'mkdocs[highlight]'"
+            )
+        self._highlight_cache_size = config['build']['highlight_cache_size']
+        # Converted markdown, keyed by the page's source and directory, so that
+        # pages can be re-rendered after a template or nav change without converting them.
+        self._markdown_cache: Optional[DiskCache] = None
+        markdown_cache_size = config['build']['markdown_cache_size']
+        if markdown_cache_size:
+            self._markdown_cache = DiskCache(os.path.join(self._cache_dir, 'markdown'), markdown_cache_size)
+
+        # State for the build in progress, in the main process.
+        self._manifest: Optional[Manifest] = None
+        self._inputs: dict[str, dict] = {}
+        # The stat result for each page's source, from when the docs were scanned.
+        self._stats: dict[str, os.stat_result] = {}
+
+        # Rendered pages for 'mkdocs serve'.
+        # Each cached page holds its rendered content in one or more encodings,
+        # with the uncompressed content stored under `None`.
+        cache_size = config['serve']['cache_size']
+        self._cache: Optional[LRUCache[dict[Optional[str], bytes]]] = LRUCache(cache_size) if cache_size else None
+        self._cache_warm = config['serve']['warm']
+        self._compress = config['serve']['compress']
+        self._reload = config['serve']['reload']
+        # Send pages as they are rendered, rather than once the render is complete.
+        self._stream = config['serve']['stream']
+        self._cached_pages: Optional[Pages] = None
+        self._cached_navigation: Optional[Navigation] = None
+        # Rendered pages shared with other processes, eg. 'mkdocs serve --workers'.
+        # Entries are also keyed by the config and the set of pages, since those
+        # aren't part of the per-page fingerprint.
+        self._shared_cache: Optional[DiskCache] = None
+        if config['serve']['shared_cache']:
+            self._shared_cache = DiskCache(os.path.join(self._cache_dir, 'serve'))
+        self._shared_key = ''
+        self._template_files: dict[str, int] = {}
+
+        # Called with each page that is rendered by 'mkdocs serve'.
+        self._render_listeners: list[Callable[[Page, PageView], None]] = []
 
     def initialize(self, site: Site) -> None:
         pages = []
-        for path in self._list_pages():
-            output_path = self._build_path(path)
-            url = url_for_path(output_path, base_url=self._base_url)
-            page = Page(
-                url=url,
-                path=path,
-                context={},
-                sections=[]
-            )
-            pages.append(page)
+        self._stats = {}
+        # Any other files are static files, see `StaticFilesHandler`.
+        for path, stat in self._docs_scan.pages:
+            pages.append(self._make_page(path))
+            self._stats[path] = stat
 
         pages = sorted(pages, key=lambda page: page.url)
         site.pages = Pages(pages)
 
-    def build(self, site: Site) -> None:
-        state = BuildState()
-        template_env = self._setup_template_env(site)
-        markdown_env = self._setup_markdown_env(site, state)
+    def build_tasks(self, site: Site) -> list[str]:
+        """
+        Return the pages that need building, using the manifest from the
+        previous build to skip any page whose inputs have not changed.
+        """
+        manifest = Manifest(self._manifest_path, 'pages', clean=self._clean)
+        templates = self._template_hashes(self._environments(site)[0])
+        navigation = self._hash_navigation(site)
+
+        keys = []
+        self._manifest = manifest
+        self._inputs = {}
+        for page in site.pages:
+            output_rel_path = self._build_path(page.path)
+            entry = manifest.get(output_rel_path)
+            inputs = {
+                'source': page.path,
+                'hash': self._source_hash(page, entry),
+                'templates': templates,
+                'config': self._config_hash,
+                'navigation': navigation,
+            }
+            if self._is_fresh(site, output_rel_path, inputs, entry):
+                # Restore the table of contents from the previous build.
+                page.sections = [Section(*section) for section in entry['sections']]
+                if not self._low_memory:
+                    for section, text in zip(page.sections, self._read_section_texts(page)):
+                        section.text = text
+            else:
+                keys.append(page.path)
+                self._inputs[page.path] = inputs
+
+        # Remove the output of any pages that no longer exist.
+        outputs = {self._build_path(page.path) for page in site.pages}
+        for output_rel_path in manifest:
+            if output_rel_path not in outputs:
+                self._remove_output(output_rel_path)
+                manifest.remove(output_rel_path)
+
+        return keys
+
+    def build_task(self, site: Site, key: str) -> dict:
+        page = site.pages.lookup_path(key)
+        view = self._build_page(page, site)
+        sections = view.sections
+        self._save_section_texts(page, sections)
+        if self._low_memory:
+            sections = [Section(section.title, section.id, section.level) for section in sections]
+        return {'sections': sections, 'links': view.links, 'anchors': view.anchors}
+
+    def collect(self, site: Site, results: dict[str, dict]) -> None:
+        assert self._manifest is not None
+        for key, result in results.items():
+            # Store the table of contents on the site,
+            # since pages may have been rendered in worker processes.
+            page = site.pages.lookup_path(key)
+            page.sections = result['sections']
+
+            stat = self._stats.get(key)
+            self._manifest.set(self._build_path(key), {
+                **self._inputs[key],
+                'stat': None if stat is None else [stat.st_mtime_ns, stat.st_size],
+                'links': result['links'],
+                'anchors': result['anchors'],
+                'sections': [[section.title, section.id, section.level] for section in page.sections],
+            })
+
+        # Record the links from every page, including those reused from the
+        # previous build, so that they can all be checked against each other.
         for page in site.pages:
-            with state.active_page(page):
-                self._build_page(page, site, template_env, markdown_env)
+            entry = self._manifest.get(self._build_path(page.path))
+            if entry is not None:
+                site.links.record(page.path, entry['links'], entry['anchors'])
+        broken = site.links.broken(site.pages)
+        if broken:
+            print(f'Found {len(broken)} broken links')
+            for link in broken:
+                print(f'  {link}')
+
+        self._manifest.save()
+        self._manifest = None
+        self._inputs = {}
+        if self._markdown_cache is not None:
+            self._markdown_cache.prune()
 
     def serve(self, site: Site, url: str) -> Optional[flask.Response]:
+        fragment = url.endswith(self.FRAGMENT_SUFFIX)
+        if fragment:
+            url = url[:-len(self.FRAGMENT_SUFFIX)] + '.html'
         page = site.pages.lookup_url(url)
         if page is None:
             return None
 
-        state = BuildState()
-        template_env = self._setup_template_env(site)
-        markdown_env = self._setup_markdown_env(site, state)
-        return self._serve_page(state, page, site, template_env, markdown_env)
+        # Compressed responses are only worthwhile if we can cache them.
+        encoding = None
+        if self._compress and self._cache is not None:
+            encoding = negotiate_encoding(flask.request)
+
+        body: Union[bytes, Iterator[bytes]]
+        if self._cache is None:
+            _, chunks = self._render_page(page, site, fragment)
+            if self._stream:
+                body = _encoded(chunks)
+            else:
+                with phase('template', page=page.path):
+                    body = ''.join(chunks).encode('utf-8')
+        else:
+            body = self._render_cached(page, site, encoding, stream=self._stream, fragment=fragment)
+            if not isinstance(body, bytes):
+                # Pages are only compressed once they are in the cache.
+                encoding = None
+
+        response = flask.Response(body, content_type='text/html; charset=utf-8')
+        if self._compress:
+            response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.content_encoding = encoding
+        return response
+
+    def update(self, site: Site, paths: set[str]) -> None:
+        changed = set()
+        for path in paths:
+            rel_path = path_within_directory(path, self._docs_dir)
+            if rel_path is None or self._ignore.ignores(rel_path):
+                continue
+            if not is_markdown(rel_path):
+                # Pages may link to static files in the docs directory.
+                changed.add(rel_path)
+                continue
+            existing = site.pages.lookup_path(rel_path)
+            if os.path.isfile(path) and existing is None:
+                site.pages.add(self._make_page(rel_path))
+                changed.add(rel_path)
+            elif not os.path.isfile(path) and existing is not None:
+                site.pages.remove(existing)
+                site.links.remove(rel_path)
+                changed.add(rel_path)
+            # Modified pages don't need any updates here,
+            # since cached renders are fingerprinted by modification time.
+
+        if changed and self._links is not None:
+            self._links.clear()
+
+        # Adding or removing a page changes the output of any page that links to it.
+        if changed:
+            self._update_shared_key(site)
+        if changed and self._cache is not None:
+            for cached_path in changed | site.links.referrers(changed):
+                self._cache.discard(cached_path)
+                self._cache.discard(cached_path + self.FRAGMENT_SUFFIX)
+
+    def reconfigure(self, site: Site, config: dict) -> None:
+        config_hash = self._hash_config(config)
+        if config_hash != self._config_hash:
+            self._config_hash = config_hash
+            self._update_shared_key(site)
+            if self._cache is not None:
+                self._cache.clear()
+
+    def load_section_texts(self, page: Page) -> list[str]:
+        """
+        Return the plain text of each of the page's sections, once it has been built.
+        """
+        if not self._low_memory:
+            return [section.text for section in page.sections]
+        return self._read_section_texts(page)
+
+    def add_render_listener(self, listener: Callable[[Page, PageView], None]) -> None:
+        self._render_listeners.append(listener)
+
+    def extract_sections(self, page: Page, site: Site) -> list[Section]:
+        """
+        Convert a page's markdown, without rendering the template,
+        and return the sections.
+        """
+        return self._convert(page, site).sections
+
+    def warm(self, site: Site) -> None:
+        if self._markdown_cache is not None:
+            threading.Thread(target=self._markdown_cache.prune, daemon=True).start()
+        if self._cache is not None and self._cache_warm:
+            thread = threading.Thread(target=self._warm_cache, args=(site,), daemon=True)
+            thread.start()
 
     # ...
 
+    def _hash_config(self, config: dict) -> str:
+        # Any change to these settings could change the output of every page.
+        return hash_data({
+            'site_name': config['site_name'],
+            'url': config['build']['url'],
+            'context': config['context'],
+            'nav': config.get('nav'),
+            'highlight': config['build']['highlight'],
+        })
+
+    def _hash_navigation(self, site: Site) -> str:
+        # The nav config only names the pages that it links to, but every page's
+        # sidebar also depends on which of those exist, and on their URLs.
+        def resolved(items: list[NavItem]) -> list:
+            return [
+                [nav.title, None if nav.page is None else [nav.page.path, nav.url], resolved(nav.children)]
+                for nav in items
+            ]
+        return hash_data(resolved(site.navigation.all))
+
+    def _make_page(self, path: str) -> Page:
+        output_path = self._build_path(path)
+        url = url_for_path(output_path, base_url=self._base_url)
+        return Page(
+            url=url,
+            path=path,
+            context={},
+            sections=[]
+        )
+
+    def _environments(self, site: Site) -> Tuple[jinja2.Environment, _MarkdownPool]:
+        """
+        Return the long-lived template environment and markdown pool for the site.
+        """
+        with self._envs_lock:
+            if self._envs_site is not site:
+                self._template_env = self._setup_template_env(site)
+                self._links = links = _LinkResolver(site)
+                # Shared by every markdown environment, since the same snippets appear on many pages.
+                highlights: Optional[LRUCache[str]] = None
+                if self._highlight:
+                    highlights = LRUCache(self._highlight_cache_size)
+                self._markdown_envs = _MarkdownPool(
+                    lambda state: self._setup_markdown_env(links, highlights, state)
+                )
+                self._envs_site = site
+            assert self._template_env is not None and self._markdown_envs is not None
+            return self._template_env, self._markdown_envs
+
     def _setup_template_env(self, site: Site) -> jinja2.Environment:
+        # Cache compiled templates on disk, so that the first render of
+        # each template is cheap, even in a new process.
+        bytecode_dir = os.path.join(self._cache_dir, 'jinja')
+        os.makedirs(bytecode_dir, exist_ok=True)
+
         # TODO: Lookup file and error if not found.
         template_env = jinja2.Environment(
             loader=jinja2.FileSystemLoader(self._templates_dir),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_dir),
+            extensions=[_FragmentCacheExtension],
         )
+        if self._fragment_cache_size:
+            template_env.fragments = LRUCache(self._fragment_cache_size)
         template_env.filters['url'] = lambda path: os.path.join(site.url, path)
+        # Whether code is highlighted already, so the template can leave out highlight.js.
+        template_env.globals['highlighted'] = self._highlight
         return template_env
 
-    def _setup_markdown_env(self, site: Site, state: BuildState) -> markdown.Markdown:
+    def _setup_markdown_env(
+        self, links: _LinkResolver, highlights: Optional[LRUCache[str]], state: BuildState
+    ) -> markdown.Markdown:
         markdown_env = markdown.Markdown(extensions=[
             # Handle triple backtick fenced code blocks.
             'fenced_code',
@@ -94,33 +541,128 @@ class PagesHandler:
 
         # Deal with rewriting URLs in the markdown, to point to the build URLs.
         markdown_env.treeprocessors.register(
-            item=_URLsProcessor(site, state),
+            item=_URLsProcessor(links, state),
             name='urls',
             priority=10,
         )
 
         # Annotate the page with sections information, for rendering a table of contents.
         markdown_env.treeprocessors.register(
-            item=_SectionsProcessor(state),
+            item=_SectionsProcessor(markdown_env, state),
             name='sections',
             priority=10,
         )
 
+        # Highlight fenced code blocks, before 'fenced_code' stashes them.
+        if highlights is not None:
+            markdown_env.preprocessors.register(
+                item=_HighlightProcessor(markdown_env, highlights),
+                name='highlight',
+                priority=26,
+            )
+
         # Support github-flavored "note", "tip", "information", "warning", "caution" blocks.
         markdown_env.parser.blockprocessors.register(
             item=markdown_gfm_admonition.GfmAdmonitionProcessor(markdown_env.parser),
             name='gfm_admonition',
             priority=105
         )
+
+        # Time each processor when profiling, so that expensive extensions show up.
+        for registry in (markdown_env.preprocessors, markdown_env.treeprocessors, markdown_env.postprocessors):
+            for processor in registry:
+                processor.run = _timed(type(processor).__name__.lstrip('_'), processor.run)
         return markdown_env
 
-    def _list_pages(self) -> List[str]:
-        return list_files_within_directory(self._docs_dir)
+    def _template_hashes(self, template_env: jinja2.Environment) -> dict[str, str]:
+        """
+        Return the hashes of 'base.html' and every template that it
+        extends, includes or imports.
+        """
+        return {
+            name: hash_file(filename)
+            for name, filename in self._referenced_templates(template_env).items()
+        }
+
+    def _referenced_templates(self, template_env: jinja2.Environment) -> dict[str, str]:
+        """
+        Return the filenames of 'base.html' and every template that it
+        extends, includes or imports.
+        """
+        filenames: dict[str, str] = {}
+        pending = ['base.html']
+        while pending:
+            name = pending.pop()
+            source, filename, _ = template_env.loader.get_source(template_env, name)
+            filenames[name] = filename
+            for referenced in jinja2.meta.find_referenced_templates(template_env.parse(source)):
+                if referenced is not None and referenced not in filenames:
+                    pending.append(referenced)
+        return filenames
+
+    def _is_fresh(self, site: Site, output_rel_path: str, inputs: dict, entry: Optional[dict]) -> bool:
+        """
+        Determine if a page from the previous build can be reused as-is.
+        """
+        if entry is None or any(entry.get(key) != value for key, value in inputs.items()):
+            return False
+        if not os.path.exists(os.path.join(self._build_dir, output_rel_path)):
+            return False
+        if self._fragments and not os.path.exists(os.path.join(self._build_dir, self._fragment_path(output_rel_path))):
+            return False
+        if not os.path.exists(self._section_texts_path(entry['source'])):
+            return False
+        # Links are rewritten to the URLs of the pages that they reference,
+        # so the page is stale if any of those pages have been added or removed.
+        return _links_unchanged(site, entry['links'])
+
+    def _remove_output(self, output_rel_path: str) -> None:
+        output_path = os.path.join(self._build_dir, output_rel_path)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        fragment_path = os.path.join(self._build_dir, self._fragment_path(output_rel_path))
+        if os.path.exists(fragment_path):
+            os.remove(fragment_path)
+        texts_path = os.path.join(self._cache_dir, 'sections', output_rel_path + '.json')
+        if os.path.exists(texts_path):
+            os.remove(texts_path)
+        directory = os.path.dirname(output_path)
+        if directory != self._build_dir.rstrip(os.sep) and os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+    def _section_texts_path(self, path: str) -> str:
+        return os.path.join(self._cache_dir, 'sections', self._build_path(path) + '.json')
+
+    def _read_section_texts(self, page: Page) -> list[str]:
+        try:
+            with open(self._section_texts_path(page.path), 'r') as input_file:
+                texts = json.load(input_file)
+        except (OSError, ValueError):
+            texts = []
+        if len(texts) != len(page.sections):
+            return [''] * len(page.sections)
+        return texts
+
+    def _save_section_texts(self, page: Page, sections: list[Section]) -> None:
+        texts_path = self._section_texts_path(page.path)
+        os.makedirs(os.path.dirname(texts_path), exist_ok=True)
+        with open(texts_path, 'w') as output_file:
+            json.dump([section.text for section in sections], output_file)
+
+    def _source_hash(self, page: Page, entry: Optional[dict]) -> str:
+        """
+        Return the hash of a page's source, reusing the hash from the previous
+        build if the size and modification time are unchanged since then.
+        """
+        stat = self._stats.get(page.path)
+        if stat is not None and entry is not None and entry.get('stat') == [stat.st_mtime_ns, stat.st_size]:
+            return entry['hash']
+        return hash_file(os.path.join(self._docs_dir, page.path))
 
     def _load_page(self, page) -> str:
         source = os.path.join(self._docs_dir, page.path)
 
-        with open(source, "r") as input_file:
+        with phase('read'), open(source, "r") as input_file:
             text = input_file.read()
         return text
 
@@ -141,52 +683,402 @@ class PagesHandler:
             return os.path.join(dirname, 'index.html')
         return os.path.join(dirname, root, 'index.html')
 
-    def _build_page(self, page: Page, site: Site, template_env: jinja2.Environment, markdown_env: markdown.Markdown) -> None:
+    def _build_page(self, page: Page, site: Site) -> PageView:
         input_rel_path = page.path
         output_rel_path = self._build_path(input_rel_path)
 
         # print(f'Build {input_rel_path!r} -> {output_rel_path!r}')
-        input_path = os.path.join(self._docs_dir, input_rel_path)
-        output_path = os.path.join(self._build_dir, output_rel_path)
+        view, chunks = self._render(page, site)
+
+        # Write the output as it is rendered, rather than holding all of it in memory.
+        with phase('write', page=page.path):
+            with phase('template'):
+                current_output().write(output_rel_path, _encoded(chunks))
+
+        if self._fragments:
+            _, chunks = self._render(page, site, fragment=True, view=view)
+            with phase('write', page=page.path):
+                with phase('template'):
+                    current_output().write(self._fragment_path(output_rel_path), _encoded(chunks))
+        return view.resolve()
+
+    def _fragment_path(self, output_rel_path: str) -> str:
+        return output_rel_path[:-len('.html')] + self.FRAGMENT_SUFFIX
 
-        with open(input_path, "r") as input_file:
-            input_text = input_file.read()
+    def _render_page(self, page: Page, site: Site, fragment: bool = False) -> Tuple[_DeferredView, Iterator[str]]:
+        """
+        Render a page, or the page's fragment, for 'mkdocs serve' as a stream of chunks.
+        """
+        view, chunks = self._render(page, site, fragment)
+        if self._reload and not fragment:
+            chunks = _insert_before(chunks, '</body>', RELOAD_SCRIPT)
+
+        def stream() -> Iterator[str]:
+            yield from _buffered(chunks, view)
+            for listener in self._render_listeners:
+                listener(page, view.resolve())
+
+        return view, stream()
 
-        page.text = input_text
-        page.html = markdown_env.convert(input_text)
+    def _render(
+        self, page: Page, site: Site, fragment: bool = False, view: Optional[_DeferredView] = None
+    ) -> Tuple[_DeferredView, Iterator[str]]:
+        """
+        Render a page, or only the page's fragment, without modifying the shared site.
+
+        The template is rendered lazily, as the returned chunks are consumed.
+        Pass the `view` from a previous render to reuse its converted markdown.
+        """
+        template_env, _ = self._environments(site)
+        if self._fragments_navigation is not site.navigation and template_env.fragments is not None:
+            # Cached fragments may render the navigation, and are keyed by nav items.
+            template_env.fragments.clear()
+            self._fragments_navigation = site.navigation
 
+        if view is None:
+            view = _DeferredView(lambda: self._convert(page, site))
         template = template_env.get_template("base.html")
-        output_text = template.render({
+        context = {
             "site": site,
-            "page": page
-        })
-
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w") as output_file:
-            output_file.write(output_text)
+            "page": view
+        }
+        if fragment:
+            chunks = _render_blocks(template, context, self.FRAGMENT_BLOCKS)
+        else:
+            chunks = template.generate(context)
+        return view, chunks
 
-    def _serve_page(self, state: BuildState, page: Page, site: Site, template_env: jinja2.Environment, markdown_env: markdown.Markdown) -> flask.Response:
+    def _convert(self, page: Page, site: Site) -> PageView:
+        """
+        Convert a page's markdown, without rendering the template.
+        """
+        _, markdown_envs = self._environments(site)
         input_text = self._load_page(page)
 
-        with state.active_page(page):
-            page.text = input_text
-            page.html = markdown_env.convert(input_text)
+        key = None
+        if self._markdown_cache is not None:
+            key = hash_data([self._converter_versions(), os.path.dirname(page.path), input_text])
+            with phase('markdown-cache', page=page.path):
+                view = self._load_converted(page, site, key, input_text)
+            if view is not None:
+                return view
+
+        with markdown_envs.acquire() as (state, markdown_env):
+            with state.active_page(page), phase('markdown', page=page.path):
+                html = markdown_env.convert(input_text)
+                view = PageView(
+                    page, text=input_text, html=html, sections=state.sections,
+                    links=state.links, anchors=state.anchors,
+                )
+
+        if key is not None:
+            with phase('markdown-cache', page=page.path):
+                self._store_converted(key, view)
+        return view
+
+    def _load_converted(self, page: Page, site: Site, key: str, input_text: str) -> Optional[PageView]:
+        assert self._markdown_cache is not None
+        content = self._markdown_cache.get(key, None)
+        if content is None:
+            return None
+        converted = json.loads(content)
+        if not _links_unchanged(site, converted['links']):
+            return None
+
+        return PageView(
+            page,
+            text=input_text,
+            html=converted['html'],
+            sections=[Section(*section) for section in converted['sections']],
+            links=converted['links'],
+            anchors=converted['anchors'],
+        )
+
+    def _store_converted(self, key: str, view: PageView) -> None:
+        assert self._markdown_cache is not None
+        content = json.dumps({
+            'html': view.html,
+            'sections': [[section.title, section.id, section.level, section.text] for section in view.sections],
+            'links': view.links,
+            'anchors': view.anchors,
+        }, separators=(',', ':'))
+        self._markdown_cache.set(key, None, content.encode('utf-8'))
+
+    def _render_cached(
+        self, page: Page, site: Site, encoding: Optional[str] = None, stream: bool = False, fragment: bool = False,
+        evict: bool = True,
+    ) -> Union[bytes, Iterator[bytes]]:
+        """
+        Return a page, or the page's fragment, from the cache, rendering it on a miss.
+
+        With `stream`, a miss is returned as an uncompressed stream of chunks,
+        which are added to the cache once the render is complete. Without
+        `evict`, a miss is only added to the cache if there is space for it.
+        """
+        assert self._cache is not None
+
+        # Every page renders the navigation, and links to other pages,
+        # so any change to either invalidates everything in the cache.
+        if self._cached_pages is not site.pages or self._cached_navigation is not site.navigation:
+            self._cache.clear()
+            self._cached_pages = site.pages
+            self._cached_navigation = site.navigation
+            self._update_shared_key(site)
+
+        # Fingerprint the inputs *before* rendering, so that any change
+        # made while rendering will cause a cache miss on the next request.
+        source = os.stat(os.path.join(self._docs_dir, page.path))
+        fingerprint = (source.st_mtime_ns, source.st_size, self._templates_fingerprint(site))
+        key = page.path + self.FRAGMENT_SUFFIX if fragment else page.path
+        variants = self._cache.get(key, fingerprint)
+        if variants is None and self._shared_cache is not None:
+            content = self._shared_cache.get(key, [self._shared_key, fingerprint])
+            if content is not None:
+                variants = {None: content}
+                self._cache.set(key, fingerprint, variants, len(content), evict)
+        if variants is None:
+            if stream:
+                return self._stream_cached(page, site, key, fingerprint, fragment)
+            view, chunks = self._render_page(page, site, fragment)
+            with phase('template', page=page.path):
+                content = ''.join(chunks).encode('utf-8')
+            variants = self._store_cached(page, site, key, fingerprint, content, view.resolve(), evict)
+
+        if encoding not in variants:
+            # Compress each page once per encoding, rather than on every request.
+            with phase('compress', page=page.path):
+                variants = {**variants, encoding: compress(variants[None], encoding)}
+            self._cache.set(key, fingerprint, variants, sum(map(len, variants.values())))
+        return variants[encoding]
+
+    def _stream_cached(self, page: Page, site: Site, key: str, fingerprint: tuple, fragment: bool) -> Iterator[bytes]:
+        view, chunks = self._render_page(page, site, fragment)
+        parts = []
+        for chunk in _encoded(chunks):
+            parts.append(chunk)
+            yield chunk
+        # Only reached if the whole page was sent.
+        self._store_cached(page, site, key, fingerprint, b''.join(parts), view.resolve())
+
+    def _store_cached(
+        self, page: Page, site: Site, key: str, fingerprint: tuple, content: bytes, view: PageView,
+        evict: bool = True,
+    ) -> dict[Optional[str], bytes]:
+        assert self._cache is not None
+        variants: dict[Optional[str], bytes] = {None: content}
+        self._cache.set(key, fingerprint, variants, len(content), evict)
+        if self._shared_cache is not None:
+            self._shared_cache.set(key, [self._shared_key, fingerprint], content)
+        # Record the links, so that the page is invalidated when any page it links to is added or removed.
+        site.links.record(page.path, view.links, view.anchors)
+        return variants
+
+    def _update_shared_key(self, site: Site) -> None:
+        # The shared cache outlives the server, so also key it by everything
+        # that links resolve against, and by the versions that convert pages.
+        if self._shared_cache is not None:
+            self._shared_key = hash_data([
+                self._config_hash,
+                self._converter_versions(),
+                [page.path for page in site.pages],
+                [file.path for file in site.files],
+            ])
+
+    def _converter_versions(self) -> list:
+        highlighter = pygments.__version__ if self._highlight else None
+        return [self.MARKDOWN_VERSION, markdown.__version__, highlighter]
+
+    def _templates_fingerprint(self, site: Site) -> tuple:
+        """
+        Return the modification times of every template used to render pages.
+        """
+        try:
+            fingerprint = tuple(os.stat(filename).st_mtime_ns for filename in self._template_files)
+        except OSError:
+            fingerprint = None
+        if not fingerprint or fingerprint != tuple(self._template_files.values()):
+            # The templates have changed, and may now reference different templates.
+            template_env = self._environments(site)[0]
+            filenames = self._referenced_templates(template_env).values()
+            self._template_files = {filename: os.stat(filename).st_mtime_ns for filename in filenames}
+            fingerprint = tuple(self._template_files.values())
+        return fingerprint
+
+    def _warm_cache(self, site: Site) -> None:
+        """
+        Render pages into the cache in navigation order, followed by
+        any pages that are not in the navigation, until the cache is full.
+        """
+        assert self._cache is not None
+
+        def walk(nav_items: list[NavItem]) -> Iterator[Page]:
+            for nav in nav_items:
+                if nav.page is not None:
+                    yield nav.page
+                yield from walk(nav.children)
+
+        ordered = {id(page): page for page in walk(site.navigation.all)}
+        ordered.update({id(page): page for page in site.pages if id(page) not in ordered})
+        for page in ordered.values():
+            if page.path not in self._cache:
+                # Stop at the first page that doesn't fit, rather than evicting pages warmed earlier.
+                self._render_cached(page, site, evict=False)
+                if page.path not in self._cache:
+                    break
+
+
+class _FragmentCacheExtension(jinja2.ext.Extension):
+    """
+    Adds a `{% cache key, ... %}...{% endcache %}` tag to templates,
+    which renders its body once for each distinct key and then reuses it.
+
+    Keys may include unhashable objects such as nav items, which are keyed
+    by identity, so the cache must be cleared whenever they are replaced.
+    Fragments are only cached once an `LRUCache` is set as `environment.fragments`.
+
+    ```
+    {% cache 'sidebar', page.breadcrumbs %}
+      ...
+    {% endcache %}
+    ```
+    """
+
+    tags = {'cache'}
+
+    def __init__(self, environment: jinja2.Environment) -> None:
+        super().__init__(environment)
+        environment.extend(fragments=None)
+
+    def parse(self, parser: jinja2.parser.Parser) -> jinja2.nodes.Node:
+        lineno = next(parser.stream).lineno
+        # Identifies this block in this compilation of the template, so
+        # that edits to the template never reuse fragments from before.
+        block = jinja2.nodes.Const(uuid.uuid4().hex)
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render', [block, jinja2.nodes.List(key)])
+        return jinja2.nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, block: str, key: list, caller: Callable[[], str]) -> str:
+        fragments = self.environment.fragments
+        if fragments is None:
+            return caller()
+        cache_key = (block, _fragment_key(key))
+        fragment = fragments.get(cache_key, None)
+        if fragment is None:
+            fragment = caller()
+            fragments.set(cache_key, None, fragment, len(fragment))
+        return fragment
+
+
+def _links_unchanged(site: Site, links: dict[str, Optional[str]]) -> bool:
+    """
+    Determine if each of the referenced source paths still resolves to the same URL.
+    """
+    return all(_url_of_path(site, path) == url for path, url in links.items())
+
+
+def _url_of_path(site: Site, path: str) -> Optional[str]:
+    """
+    Return the URL of the page or static file with the given source path.
+    """
+    page = site.pages.lookup_path(path)
+    if page is not None:
+        return page.url
+    file = site.files.lookup_path(path)
+    if file is not None:
+        return file.url
+    return None
+
+
+def _fragment_key(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_fragment_key(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return ('id', id(value))
+    return value
+
+
+def _render_blocks(template: jinja2.Template, context: dict, names: Tuple[str, ...]) -> Iterator[str]:
+    """
+    Render only the named blocks of a template, each wrapped
+    in an element naming the block, eg. `<div data-fragment="toc">`.
+    """
+    block_context = template.new_context(context)
+    for name in names:
+        if name in template.blocks:
+            yield f'<div data-fragment="{name}">'
+            yield from template.blocks[name](block_context)
+            yield '</div>'
+
+
+def _buffered(chunks: Iterator[str], view: _DeferredView, size: int = 16 * 1024) -> Iterator[str]:
+    """
+    Join the many small chunks generated by a template into larger ones.
+
+    Until the page's markdown has been converted, chunks are passed straight
+    through, so that the head of the page is sent without waiting for it.
+    """
+    buffer: list[str] = []
+    buffered = 0
+    for chunk in chunks:
+        if not view.resolved:
+            yield chunk
+            continue
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield ''.join(buffer)
 
-            template = template_env.get_template("base.html")
-            content = template.render({
-                "site": site,
-                "page": page
-            })
 
-        return flask.make_response(content)
+def _insert_before(chunks: Iterator[str], marker: str, text: str) -> Iterator[str]:
+    """
+    Insert text before the first occurrence of a marker, which may be split across chunks.
+    """
+    keep = len(marker) - 1
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        index = pending.find(marker)
+        if index != -1:
+            yield pending[:index] + text + pending[index:]
+            yield from chunks
+            return
+        if len(pending) > keep:
+            yield pending[:-keep]
+            pending = pending[-keep:]
+    if pending:
+        yield pending
+
+
+def _timed(name: str, run: Callable) -> Callable:
+    def timed_run(*args, **kwargs):
+        with phase(name):
+            return run(*args, **kwargs)
+    return timed_run
+
+
+def _encoded(chunks: Iterator[str]) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield chunk.encode('utf-8')
 
 
 class _URLsProcessor(markdown.treeprocessors.Treeprocessor):
-    def __init__(self, site: Site, state: BuildState) -> None:
-        self._site = site
+    def __init__(self, links: _LinkResolver, state: BuildState) -> None:
+        self._links = links
         self._state = state
 
     def run(self, root: etree.Element) -> etree.Element:
+        current_page = self._state.current_page
+        current_directory = os.path.dirname(current_page.path)
+
         for element in root.iter():
             if element.tag == 'a':
                 key = 'href'
@@ -195,53 +1087,47 @@ class _URLsProcessor(markdown.treeprocessors.Treeprocessor):
             else:
                 continue
 
-            url_or_path = element.get(key)
-            if url_or_path is not None:
-                output_url = self.rewrite_url(url_or_path)
-                element.set(key, output_url)
-
-        return root
-
-    def rewrite_url(self, url_or_path: str) -> str:
-        # TODO: Improve
-        if url_or_path.startswith('http://') or url_or_path.startswith('https://'):
-            return url_or_path
+            href = element.get(key)
+            if href is None:
+                continue
+            if href.startswith('#'):
+                # An anchor on the current page.
+                self._state.anchors.setdefault(current_page.path, []).append(href[1:])
+                continue
 
-        current_page = self._state.current_page
-        current_directory = os.path.dirname(current_page.path)
+            output_url, path, url, fragment = self._links.resolve(current_directory, href)
+            if path is not None:
+                self._state.links[path] = url
+                if fragment and url is not None:
+                    self._state.anchors.setdefault(path, []).append(fragment)
+            element.set(key, output_url)
 
-        referenced_path = os.path.normpath(os.path.join(current_directory, url_or_path))
-        referenced_page = self._site.pages.lookup_path(referenced_path)
-        if referenced_page is None:
-            return "#"
-        return referenced_page.url
+        return root
 
 
 class _SectionsProcessor(markdown.treeprocessors.Treeprocessor):
     """
-    This processor does exactly two things:
+    This processor does exactly three things:
 
     * Annotate headers with an 'id' attribute,
       which will be present in the output HTML.
     * Annotate the current page with a 'sections' attribute,
       which can be used to render a table of contents.
+    * Save the plain text content of each section,
+      which can be used to generate search indexes.
     """
 
-    # TODO:
-    #
-    # We would also like to save the 'text' attribute to sections,
-    # so that we can use them to generate search indexes.
-    #
-    # The 'fenced_code' extension is a bit awkward for us here,
-    # as it hides the content of the code blocks into an html stash.
-    #
-    # Useful pointers...
-    #
-    # HashHeaderProcessor, SetextHeaderProcessor
-    # BacktickInlineProcessor(BACKTICK_RE), 'backtick', 190)
-    # RawHtmlPostprocessor
-
-    def __init__(self, state: BuildState):
+    HEADINGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+    # Elements which should be separated from their neighbours
+    # by whitespace, when flattened into plain text.
+    BLOCKS = (
+        'p', 'div', 'pre', 'blockquote', 'ul', 'ol', 'li', 'dl', 'dt', 'dd',
+        'table', 'thead', 'tbody', 'tr', 'th', 'td', 'hr', 'br',
+    )
+
+    def __init__(self, md: markdown.Markdown, state: BuildState):
+        super().__init__(md)
         self._state = state
 
     def run(self, root: etree.Element) -> etree.Element:
@@ -251,7 +1137,7 @@ class _SectionsProcessor(markdown.treeprocessors.Treeprocessor):
 
         sections = []
         for element in root.iter():
-            if element.tag in ('h1', 'h2', 'h3', 'h4', 'h5', 'h6'):
+            if element.tag in self.HEADINGS:
                 level = int(element.tag[1])
                 title = ''.join(element.itertext())
                 id = title_to_id(title)
@@ -264,6 +1150,117 @@ class _SectionsProcessor(markdown.treeprocessors.Treeprocessor):
                     level=level
                 ))
 
-        # Set the sections on the current page, as a side-effect.
-        self._state.current_page.sections = sections
+        # Collect the text following each heading, with any text
+        # before the first heading belonging to the first section.
+        chunks: list[list[str]] = [[]]
+        self._collect_text(root, chunks)
+        if len(chunks) > 1:
+            chunks[1] = chunks[0] + chunks[1]
+        for section, section_chunks in zip(sections, chunks[1:]):
+            section.text = ' '.join(''.join(section_chunks).split())
+
+        # Set the sections for the current page, as a side-effect.
+        self._state.sections = sections
         return root
+
+    def _collect_text(self, element: etree.Element, chunks: list[list[str]]) -> None:
+        if element.tag in self.HEADINGS:
+            chunks.append([])
+        else:
+            if element.text:
+                chunks[-1].append(self._unstash(element.text))
+            for child in element:
+                self._collect_text(child, chunks)
+            if element.tag in self.BLOCKS:
+                chunks[-1].append(' ')
+        if element.tail:
+            chunks[-1].append(self._unstash(element.tail))
+
+    def _unstash(self, text: str) -> str:
+        """
+        Replace any placeholders with the plain text of the stashed html.
+
+        Extensions such as 'fenced_code' hide their output in the html stash,
+        which is only substituted back into the document after the tree has
+        been serialized.
+        """
+        def replace(match: re.Match) -> str:
+            index = int(match.group(1))
+            if index >= self.md.htmlStash.html_counter:
+                return ''
+            stashed = self.md.htmlStash.rawHtmlBlocks[index]
+            if not isinstance(stashed, str):
+                stashed = etree.tostring(stashed, encoding='unicode')
+            return ' ' + html.unescape(re.sub(r'<[^>]*>', ' ', stashed)) + ' '
+
+        return markdown.util.HTML_PLACEHOLDER_RE.sub(replace, text)
+
+
+class _HighlightProcessor(FencedBlockPreprocessor):
+    """
+    Highlight fenced code blocks with Pygments, ahead of 'fenced_code',
+    which is left to handle any blocks without a language that Pygments knows.
+
+    Supports the same syntax as 'fenced_code', including `{.lang #id .class}`
+    attributes, and `hl_lines` to emphasize lines. Highlighted code is cached by
+    language, a hash of the code and the lines to emphasize, so that snippets
+    repeated across pages are only highlighted once.
+    """
+
+    def __init__(self, md: markdown.Markdown, cache: LRUCache[str]) -> None:
+        super().__init__(md, {})
+        self._cache = cache
+
+    def run(self, lines: list[str]) -> list[str]:
+        text = "\n".join(lines)
+        index = 0
+        while True:
+            match = self.FENCED_BLOCK_RE.search(text, index)
+            if match is None:
+                break
+            highlighted = self._highlight_block(match)
+            if highlighted is None:
+                index = match.end()
+                continue
+            placeholder = self.md.htmlStash.store(highlighted)
+            text = f'{text[:match.start()]}\n{placeholder}\n{text[match.end():]}'
+            index = match.start() + 1 + len(placeholder)
+        return text.split("\n")
+
+    def _highlight_block(self, match: re.Match) -> Optional[str]:
+        # Parse the block's options the same way as 'fenced_code'.
+        language, id, classes, config = match.group('lang'), '', [], {}
+        if match.group('attrs'):
+            attrs, remainder = get_attrs_and_remainder(match.group('attrs'))
+            if remainder:
+                return None
+            id, classes, config = self.handle_attrs(attrs)
+            language = classes.pop(0) if classes else None
+        elif match.group('hl_lines'):
+            config['hl_lines'] = parse_hl_lines(match.group('hl_lines'))
+        if not language:
+            return None
+
+        code = match.group('code')
+        hl_lines = config.get('hl_lines', [])
+        key = (language, hash_data([code, hl_lines]))
+        highlighted = self._cache.get(key, None)
+        if highlighted is None:
+            try:
+                lexer = pygments.lexers.get_lexer_by_name(language)
+            except pygments.util.ClassNotFound:
+                # Remember unknown languages too, as an empty string.
+                highlighted = ''
+            else:
+                formatter = pygments.formatters.HtmlFormatter(cssclass='highlight', hl_lines=hl_lines)
+                highlighted = pygments.highlight(code, lexer, formatter)
+            self._cache.set(key, None, highlighted, len(highlighted) + len(key[1]))
+        if not highlighted:
+            return None
+
+        if id or classes:
+            attributes = f' class="{html.escape(" ".join([*classes, "highlight"]))}"'
+            if id:
+                attributes = f' id="{html.escape(id)}"' + attributes
+            highlighted = highlighted.replace('<div class="highlight">', f'<div{attributes}>', 1)
+        return highlighted
@@ -0,0 +1,204 @@
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import asdict
+from typing import Iterator, Optional
+
+from .base import Handler
+from .pages import PagesHandler
+from ..manifest import Manifest
+from ..output import current_output
+from ..search import SearchIndex, section_refs
+from ..site import Page, PageView, Site
+from ..utils import hash_data, path_within_directory, url_for_path
+
+import flask
+
+# Lunr only splits words on whitespace and hyphens, so also split on
+# punctuation that is common in code, such as 'print("hello")' or 'os.path'.
+SEPARATORS = re.compile(r'[()\[\]{}<>"\'`=,;:.\\/|*&!?+]+')
+
+try:
+    import lunr
+except ImportError:  # pragma: no cover
+    lunr = None
+
+
+class SearchHandler(Handler):
+    """
+    Provides search over every page section.
+
+    When building, writes a search index for the browser to query.
+
+    The index is split into shards of a fixed number of sections, which the
+    browser downloads one at a time the first time that the user searches,
+    showing results from the shards loaded so far. When the `lunr` package
+    is installed each shard contains a prebuilt Lunr index, and otherwise
+    the browser builds the index for each shard as it loads.
+
+    ```
+    search/index.json        # {"shards": [{"url": "search/shard-0.json?v=..."}, ...]}
+    search/shard-0.json      # {"index": {...}, "documents": [...]}
+    ```
+
+    Shards are only rewritten when the sections they contain have changed.
+
+    When serving, answers `/search?q=...` with JSON results from an in-memory
+    index, which is built in the background once the server has started and
+    then updated whenever a page is rendered or changes on disk.
+    """
+
+    def __init__(self, config: dict, pages: PagesHandler) -> None:
+        self._enabled = config['build']['search']['enabled']
+        self._shard_size = config['build']['search']['shard_size']
+        self._build_dir = config['directories']['build']
+        self._manifest_path = config['build']['manifest']
+        self._clean = config['build']['clean']
+
+        self._docs_dir = config['directories']['docs']
+        self._serve_enabled = config['serve']['search']
+        self._pages = pages
+        self._index = SearchIndex()
+        self._indexed = threading.Event()
+
+    def build(self, site: Site) -> None:
+        if not self._enabled:
+            return
+
+        search_dir = os.path.join(self._build_dir, 'search')
+        manifest = Manifest(self._manifest_path, 'search', clean=self._clean)
+
+        shards = []
+        for shard in self._shards(site):
+            name = f'shard-{len(shards)}.json'
+            digest = hash_data([shard, lunr is not None])
+            path = os.path.join(search_dir, name)
+            if manifest.get(name) != {'hash': digest} or not os.path.exists(path):
+                self._write_json(f'search/{name}', self._build_shard(shard))
+                manifest.set(name, {'hash': digest})
+            shards.append({'url': f'search/{name}?v={digest[:16]}', 'documents': len(shard)})
+
+        # Remove any shards left over from a previous, larger, build.
+        names = {f'shard-{index}.json' for index in range(len(shards))}
+        for name in manifest:
+            if name not in names:
+                path = os.path.join(search_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+                manifest.remove(name)
+
+        self._write_json('search/index.json', {
+            'shards': shards,
+            'prebuilt': lunr is not None,
+        })
+        manifest.save()
+
+    def serve(self, site: Site, url: str) -> Optional[flask.Response]:
+        if not self._serve_enabled or url != url_for_path('search', base_url=site.url):
+            return None
+
+        query = flask.request.args.get('q', '')
+        limit = min(flask.request.args.get('limit', 10, type=int), 100)
+        start = time.perf_counter()
+        results = self._index.search(query, limit=limit)
+        return flask.jsonify({
+            'query': query,
+            'results': [asdict(result) for result in results],
+            # False while the initial index is still being built.
+            'complete': self._indexed.is_set(),
+            'took_ms': round((time.perf_counter() - start) * 1000, 3),
+        })
+
+    def update(self, site: Site, paths: set[str]) -> None:
+        if not self._serve_enabled:
+            return
+        for path in paths:
+            rel_path = path_within_directory(path, self._docs_dir)
+            if rel_path is None:
+                continue
+            page = site.pages.lookup_path(rel_path)
+            if page is None:
+                self._index.remove(rel_path)
+            else:
+                self._index_page(page, site)
+
+    def warm(self, site: Site) -> None:
+        if self._serve_enabled:
+            self._pages.add_render_listener(self._on_render)
+            thread = threading.Thread(target=self._index_site, args=(site,), daemon=True)
+            thread.start()
+
+    # ...
+
+    def _index_site(self, site: Site) -> None:
+        for page in list(site.pages):
+            self._index_page(page, site)
+        self._indexed.set()
+
+    def _index_page(self, page: Page, site: Site) -> None:
+        try:
+            sections = self._pages.extract_sections(page, site)
+        except OSError:
+            # The page has been removed since we started.
+            self._index.remove(page.path)
+            return
+        self._index.update(page.path, page.url, sections)
+
+    def _on_render(self, page: Page, view: PageView) -> None:
+        self._index.update(page.path, page.url, view.sections)
+
+    def _shards(self, site: Site) -> Iterator[list[dict]]:
+        """
+        Split the documents for every page into shards, holding
+        no more than one shard of documents in memory at a time.
+        """
+        shard: list[dict] = []
+        for page in site.pages:
+            for document in self._documents(page):
+                shard.append(document)
+                if len(shard) == self._shard_size:
+                    yield shard
+                    shard = []
+        if shard:
+            yield shard
+
+    def _documents(self, page: Page) -> list[dict]:
+        if not page.sections:
+            return []
+
+        page_title = page.sections[0].title
+        texts = self._pages.load_section_texts(page)
+        return [
+            {
+                'ref': ref,
+                'title': section.title,
+                'page': page_title,
+                'text': SEPARATORS.sub(' ', text),
+            }
+            for section, text, ref in zip(page.sections, texts, section_refs(page.url, page.sections))
+        ]
+
+    def _build_shard(self, documents: list[dict]) -> dict:
+        if lunr is None:
+            return {'index': None, 'documents': documents}
+
+        index = lunr.lunr(
+            ref='ref',
+            fields=[{'field_name': 'title', 'boost': 10}, 'text'],
+            documents=documents,
+        )
+        # The browser only needs the text to build the index itself,
+        # so leave it out of the prebuilt shards.
+        return {
+            'index': index.serialize(),
+            'documents': [
+                {key: value for key, value in document.items() if key != 'text'}
+                for document in documents
+            ],
+        }
+
+    def _write_json(self, path: str, data: dict) -> None:
+        content = json.dumps(data, separators=(',', ':'))
+        current_output().write(path, [content.encode('utf-8')])
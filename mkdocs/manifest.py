@@ -0,0 +1,66 @@
+from typing import Iterator, Optional
+import json
+
+
+class Manifest:
+    """
+    A record of the inputs that each build output was generated from,
+    persisted between builds so that unchanged outputs can be skipped.
+
+    The manifest file is shared between handlers, with each handler
+    owning a separate section of it...
+
+    ```json
+    {
+        "version": 4,
+        "pages": {"about/index.html": {"source": "about.md", ...}},
+        "files": {"css/base.css": {"source": "css/base.css", ...}}
+    }
+    ```
+    """
+    VERSION = 4
+
+    def __init__(self, path: Optional[str], section: str, clean: bool = False) -> None:
+        # Without a path, the manifest starts empty and is never saved.
+        self._path = path
+        self._section = section
+        self._data = {} if clean else self._load()
+        self._entries: dict[str, dict] = self._data.setdefault(section, {})
+
+    def get(self, output: str) -> Optional[dict]:
+        return self._entries.get(output)
+
+    def set(self, output: str, entry: dict) -> None:
+        self._entries[output] = entry
+
+    def remove(self, output: str) -> None:
+        self._entries.pop(output, None)
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        # Reload before writing, so that we don't clobber sections
+        # which have been saved by other handlers in the meantime.
+        data = self._load()
+        data[self._section] = self._entries
+        data['version'] = self.VERSION
+        with open(self._path, 'w') as file:
+            json.dump(data, file, indent=1, sort_keys=True)
+
+    def _load(self) -> dict:
+        if self._path is None:
+            return {}
+        try:
+            with open(self._path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return {}
+        return data
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,318 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
+import io
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+
+from .compression import ENCODINGS, compress, is_compressible
+
+
+# Archive formats, by file extension, along with the mode for `tarfile.open()`.
+TAR_MODES = {
+    '.tar': 'w',
+    '.tar.gz': 'w:gz',
+    '.tgz': 'w:gz',
+    '.tar.bz2': 'w:bz2',
+    '.tar.xz': 'w:xz',
+}
+
+
+def is_archive(target: str) -> bool:
+    return target.endswith('.zip') or target.endswith(tuple(TAR_MODES))
+
+
+class Output:
+    """
+    Where a build writes the site, such as a directory or an archive.
+
+    Paths are relative to the root of the site, and writing to a path
+    replaces anything previously written to it. Outputs are closed once
+    the build has finished, or discarded if the build fails.
+    """
+
+    # Whether the output is kept between builds, so that outputs
+    # which haven't changed since the last build can be skipped.
+    incremental = False
+
+    def write(self, path: str, chunks: Iterable[bytes]) -> None:
+        raise NotImplementedError()
+
+    def copy(self, source: str, path: str) -> None:
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+    def discard(self) -> None:
+        pass
+
+    def __enter__(self) -> "Output":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def open_output(target: str, method: str = 'copy', encodings: Sequence[str] = ()) -> Output:
+    """
+    Return the output for a directory, or for an archive if the target
+    has an archive extension, eg. 'site.zip' or 'site.tar.gz'.
+
+    Directories are written with the given method, see `DirectoryOutput`.
+    Archives also include precompressed variants of text files, in each
+    of the given encodings.
+    """
+    if target.endswith('.zip'):
+        return ZipOutput(target, encodings)
+    for extension, mode in TAR_MODES.items():
+        if target.endswith(extension):
+            return TarOutput(target, mode, encodings)
+    return DirectoryOutput(target, method)
+
+
+class DirectoryOutput(Output):
+    """
+    Writes the site to a directory.
+
+    Static files are written with `method`: 'copy', 'hardlink' or 'reflink'.
+    Links fall back to a copy where the filesystem does not support them.
+    """
+
+    incremental = True
+
+    def __init__(self, directory: str, method: str = 'copy') -> None:
+        self.directory = directory
+        self._method = method
+        # The directories that are known to exist, to save a 'makedirs' per file.
+        self._directories: set[str] = set()
+
+    def write(self, path: str, chunks: Iterable[bytes]) -> None:
+        # Writing to a temporary file means that a failed write never leaves a partial output.
+        output_path = self._prepare(path)
+        temp_path = output_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as output_file:
+                output_file.writelines(chunks)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        os.replace(temp_path, output_path)
+
+    def copy(self, source: str, path: str) -> None:
+        output_path = self._prepare(path)
+
+        # Never write through an existing output, which may be a hardlink to the source.
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+
+        if self._method == 'hardlink':
+            try:
+                os.link(source, output_path)
+                return
+            except OSError:
+                pass  # Eg. the build directory is on a different filesystem.
+        elif self._method == 'reflink' and hasattr(os, 'copy_file_range'):
+            try:
+                self._copy_file_range(source, output_path)
+                shutil.copystat(source, output_path)
+                return
+            except OSError:
+                if os.path.lexists(output_path):
+                    os.remove(output_path)
+
+        # Copy the modification time too, so unchanged files are skipped next build.
+        shutil.copy2(source, output_path)
+
+    # ...
+
+    def _prepare(self, path: str) -> str:
+        output_path = os.path.join(self.directory, path)
+        directory = os.path.dirname(output_path)
+        if directory not in self._directories:
+            os.makedirs(directory, exist_ok=True)
+            self._directories.add(directory)
+        return output_path
+
+    def _copy_file_range(self, source: str, path: str) -> None:
+        """
+        Copy a file within the kernel, which on filesystems such as
+        btrfs and XFS shares the underlying data blocks with the source.
+        """
+        with open(source, 'rb') as input_file, open(path, 'wb') as output_file:
+            remaining = os.fstat(input_file.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(input_file.fileno(), output_file.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+
+
+class _ArchiveOutput(Output):
+    """
+    Writes the site to an archive, which is built under a temporary
+    name and only moved into place once it is complete.
+    """
+
+    def __init__(self, path: str, encodings: Sequence[str]) -> None:
+        self._path = path
+        self._temp_path = path + '.tmp'
+        self._encodings = list(encodings)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def write(self, path: str, chunks: Iterable[bytes]) -> None:
+        if self._encodings and is_compressible(path):
+            content = b''.join(chunks)
+            self._add(path, [content])
+            self._add_variants(path, content)
+        else:
+            self._add(path, chunks)
+
+    def copy(self, source: str, path: str) -> None:
+        if self._encodings and is_compressible(path):
+            with open(source, 'rb') as input_file:
+                content = input_file.read()
+            self._add(path, [content])
+            self._add_variants(path, content)
+        else:
+            self._add_file(source, path)
+
+    def close(self) -> None:
+        self._close()
+        os.replace(self._temp_path, self._path)
+
+    def discard(self) -> None:
+        self._close()
+        os.remove(self._temp_path)
+
+    # ...
+
+    def _add_variants(self, path: str, content: bytes) -> None:
+        for encoding in self._encodings:
+            self._add(path + ENCODINGS[encoding], [compress(content, encoding)])
+
+    def _add(self, path: str, chunks: Iterable[bytes]) -> None:
+        raise NotImplementedError()
+
+    def _add_file(self, source: str, path: str) -> None:
+        raise NotImplementedError()
+
+    def _close(self) -> None:
+        raise NotImplementedError()
+
+
+class TarOutput(_ArchiveOutput):
+    def __init__(self, path: str, mode: str = 'w', encodings: Sequence[str] = ()) -> None:
+        super().__init__(path, encodings)
+        self._tar = tarfile.open(self._temp_path, mode, dereference=True)
+        self._mtime = int(time.time())
+
+    def _add(self, path: str, chunks: Iterable[bytes]) -> None:
+        # Tar headers include the size, so the content has to be held in memory.
+        content = b''.join(chunks)
+        info = tarfile.TarInfo(_archive_name(path))
+        info.size = len(content)
+        info.mtime = self._mtime
+        info.mode = 0o644
+        self._tar.addfile(info, io.BytesIO(content))
+
+    def _add_file(self, source: str, path: str) -> None:
+        self._tar.add(source, arcname=_archive_name(path), recursive=False)
+
+    def _close(self) -> None:
+        self._tar.close()
+
+
+class ZipOutput(_ArchiveOutput):
+    """
+    Writes the site to a zip file, deflating text files, and storing
+    other files, which are usually compressed already, as they are.
+    """
+
+    def __init__(self, path: str, encodings: Sequence[str] = ()) -> None:
+        super().__init__(path, encodings)
+        self._zip = zipfile.ZipFile(self._temp_path, 'w')
+        self._date_time = time.localtime()[:6]
+
+    def _add(self, path: str, chunks: Iterable[bytes]) -> None:
+        info = zipfile.ZipInfo(_archive_name(path), date_time=self._date_time)
+        info.compress_type = self._compress_type(path)
+        info.external_attr = 0o644 << 16
+        with self._zip.open(info, 'w') as output_file:
+            for chunk in chunks:
+                output_file.write(chunk)
+
+    def _add_file(self, source: str, path: str) -> None:
+        self._zip.write(source, arcname=_archive_name(path), compress_type=self._compress_type(path))
+
+    def _close(self) -> None:
+        self._zip.close()
+
+    def _compress_type(self, path: str) -> int:
+        return zipfile.ZIP_DEFLATED if is_compressible(path) else zipfile.ZIP_STORED
+
+
+class BufferedOutput(Output):
+    """
+    Records what is written, so that it can be written to another output later.
+
+    Used by parallel build workers when writing an archive, which
+    can only be written to from the main process.
+    """
+
+    def __init__(self) -> None:
+        # The path of each output, with either its content or the file to copy it from.
+        self.writes: list[Tuple[str, Optional[bytes], Optional[str]]] = []
+
+    def write(self, path: str, chunks: Iterable[bytes]) -> None:
+        self.writes.append((path, b''.join(chunks), None))
+
+    def copy(self, source: str, path: str) -> None:
+        self.writes.append((path, None, source))
+
+
+def replay(writes: list[Tuple[str, Optional[bytes], Optional[str]]], output: Output) -> None:
+    """
+    Write the outputs recorded by a `BufferedOutput` to another output.
+    """
+    for path, content, source in writes:
+        if source is not None:
+            output.copy(source, path)
+        else:
+            assert content is not None
+            output.write(path, [content])
+
+
+def _archive_name(path: str) -> str:
+    return path.replace(os.sep, '/')
+
+
+# The current output...
+#
+# Handlers write to the output for the current context, which is set by
+# `MkDocs.build()`, and in each parallel build worker while it runs tasks.
+
+_output: ContextVar[Optional[Output]] = ContextVar('output', default=None)
+
+
+@contextmanager
+def writing(output: Output) -> Iterator[Output]:
+    token = _output.set(output)
+    try:
+        yield output
+    finally:
+        _output.reset(token)
+
+
+def current_output() -> Output:
+    output = _output.get()
+    assert output is not None, "Outputs are only written while building."
+    return output
@@ -0,0 +1,205 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import ContextManager, Iterator, Optional
+import os
+import re
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+@dataclass
+class Span:
+    """
+    A single timed phase, such as converting the markdown for one page.
+
+    Times are in seconds. `exclusive` is the duration excluding any phases
+    nested inside this one, so exclusive times can be summed without
+    counting anything twice.
+    """
+    name: str
+    category: str
+    page: Optional[str]
+    start: float
+    duration: float
+    exclusive: float
+    pid: int
+    tid: int
+
+
+class Profiler:
+    """
+    Collects the phases recorded while it is active, from any thread.
+    """
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def extend(self, spans: list[Span]) -> None:
+        with self._lock:
+            self.spans.extend(spans)
+
+    def phase_totals(self) -> dict[str, tuple[float, int]]:
+        """
+        Return the total exclusive time and count of each phase,
+        in the order that phases were first recorded.
+        """
+        totals: dict[str, tuple[float, int]] = {}
+        for span in self.spans:
+            if span.category == 'handler':
+                continue
+            total, count = totals.get(span.name, (0.0, 0))
+            totals[span.name] = (total + span.exclusive, count + 1)
+        return totals
+
+    def report(self, limit: int = 10) -> str:
+        lines = ['Handlers']
+        for span in self.spans:
+            if span.category == 'handler' and span.pid == os.getpid():
+                lines.append(f'  {span.name:<40} {span.duration * 1000:>10.1f}ms')
+
+        lines += ['', 'Phases (summed across workers, excluding nested phases)']
+        totals = sorted(self.phase_totals().items(), key=lambda item: item[1][0], reverse=True)
+        for name, (total, count) in totals:
+            lines.append(f'  {name:<40} {total * 1000:>10.1f}ms {count:>8} x {total / count * 1000:>8.2f}ms')
+
+        pages: dict[str, dict[str, float]] = {}
+        for span in self.spans:
+            if span.page is not None and span.category != 'handler':
+                phases = pages.setdefault(span.page, {})
+                phases[span.name] = phases.get(span.name, 0.0) + span.exclusive
+        slowest = sorted(pages.items(), key=lambda item: sum(item[1].values()), reverse=True)[:limit]
+
+        lines += ['', 'Slowest pages']
+        for path, phases in slowest:
+            top = sorted(phases.items(), key=lambda item: item[1], reverse=True)[:3]
+            breakdown = ', '.join(f'{name} {duration * 1000:.1f}ms' for name, duration in top)
+            lines.append(f'  {path:<40} {sum(phases.values()) * 1000:>10.1f}ms  ({breakdown})')
+        return '\n'.join(lines)
+
+    def trace_events(self) -> dict:
+        """
+        Return the spans in the Trace Event Format, which can be opened
+        with chrome://tracing or https://ui.perfetto.dev.
+        """
+        events = []
+        for span in self.spans:
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': span.start * 1_000_000,
+                'dur': span.duration * 1_000_000,
+                'pid': span.pid,
+                'tid': span.tid,
+                'args': {} if span.page is None else {'page': span.page},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def server_timing(self, total: float) -> str:
+        """
+        Return a 'Server-Timing' header value, with the time spent in each phase in milliseconds.
+        """
+        metrics = [
+            f'{_TOKEN_INVALID.sub("-", name)};dur={duration * 1000:.2f}'
+            for name, (duration, _) in self.phase_totals().items()
+        ]
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+def peak_memory() -> Optional[tuple[int, int]]:
+    """
+    Return the peak resident set size of this process, and of the largest
+    child process that has exited (eg. a build worker), in bytes.
+    """
+    if resource is None:
+        return None
+    # Reported in kilobytes on Linux, and in bytes on macOS.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own, children
+
+
+# Recording phases...
+#
+# Phases are recorded against the profiler for the current context, if any,
+# so that concurrent requests in 'mkdocs serve' are profiled separately.
+# When no profiler is active, `phase()` returns a shared no-op context manager.
+
+_profiler: ContextVar[Optional[Profiler]] = ContextVar('profiler', default=None)
+_stacks = threading.local()
+_NOOP = nullcontext()
+_TOKEN_INVALID = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+@contextmanager
+def profiling(profiler: Profiler) -> Iterator[Profiler]:
+    token = _profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        _profiler.reset(token)
+
+
+def current_profiler() -> Optional[Profiler]:
+    return _profiler.get()
+
+
+def phase(name: str, category: str = 'phase', page: Optional[str] = None) -> ContextManager:
+    """
+    Time a phase, which belongs to the given page, or otherwise
+    to the same page as the phase that it is nested inside.
+    """
+    profiler = _profiler.get()
+    if profiler is None:
+        return _NOOP
+    return _Phase(profiler, name, category, page)
+
+
+class _Phase:
+    def __init__(self, profiler: Profiler, name: str, category: str, page: Optional[str]) -> None:
+        self._profiler = profiler
+        self._name = name
+        self._category = category
+        self._page = page
+        self._start = 0.0
+        self._nested = 0.0
+
+    def __enter__(self) -> None:
+        stack = getattr(_stacks, 'stack', None)
+        if stack is None:
+            stack = _stacks.stack = []
+        if self._page is None and stack:
+            self._page = stack[-1]._page
+        stack.append(self)
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        duration = time.perf_counter() - self._start
+        stack = _stacks.stack
+        stack.pop()
+        if stack:
+            stack[-1]._nested += duration
+        self._profiler.record(Span(
+            name=self._name,
+            category=self._category,
+            page=self._page,
+            start=self._start,
+            duration=duration,
+            exclusive=duration - self._nested,
+            pid=os.getpid(),
+            tid=threading.get_ident(),
+        ))
@@ -0,0 +1,177 @@
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Iterator, Optional
+import heapq
+import math
+import re
+import threading
+
+
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN.findall(text.lower())
+
+
+def section_refs(url: str, sections: list) -> list[str]:
+    """
+    Return a unique reference for each of a page's sections, linking the
+    first section to the page itself, and the rest to their anchors.
+    """
+    return [url if index == 0 else f'{url}#{section.id}' for index, section in enumerate(sections)]
+
+
+@dataclass
+class SearchDocument:
+    ref: str
+    title: str
+    page: str
+
+
+@dataclass
+class SearchResult:
+    ref: str
+    title: str
+    page: str
+    score: float
+
+
+class SearchIndex:
+    """
+    An in-memory inverted index of page sections, which can be updated
+    one page at a time.
+
+    Matches in section titles are weighted above matches in section text,
+    and matches in top level sections above those in subsections. The last
+    term of a query also matches any indexed term which it is a prefix of,
+    so that results can be shown as the user types.
+    """
+
+    TITLE_BOOST = 10.0
+    LEVEL_BOOST = {1: 2.0, 2: 1.5}
+    PREFIX_BOOST = 0.5
+    MAX_PREFIX_TERMS = 100
+
+    def __init__(self) -> None:
+        self._documents: dict[int, SearchDocument] = {}
+        self._postings: dict[str, dict[int, float]] = {}
+        self._pages: dict[str, list[int]] = {}
+        # The terms of each document, so that its postings can be removed along with it.
+        self._document_terms: dict[int, list[str]] = {}
+        # Every indexed term in order, for prefix matching. Sorted again
+        # on the first prefix query after any terms are added or removed.
+        self._terms: Optional[list[str]] = []
+        self._next_id = 0
+        self._lock = threading.RLock()
+
+    def update(self, path: str, url: str, sections: list) -> None:
+        """
+        Replace the indexed sections for the page with the given source path.
+        """
+        with self._lock:
+            self.remove(path)
+            if not sections:
+                return
+
+            page_title = sections[0].title
+            doc_ids = []
+            for section, ref in zip(sections, section_refs(url, sections)):
+                doc_id = self._next_id
+                self._next_id += 1
+                doc_ids.append(doc_id)
+                self._documents[doc_id] = SearchDocument(
+                    ref=ref,
+                    title=section.title,
+                    page=page_title,
+                )
+
+                boost = self.LEVEL_BOOST.get(section.level, 1.0)
+                weights: dict[str, float] = {}
+                for term in tokenize(section.title):
+                    weights[term] = weights.get(term, 0.0) + self.TITLE_BOOST * boost
+                for term in tokenize(section.text):
+                    weights[term] = weights.get(term, 0.0) + boost
+
+                for term, weight in weights.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = {}
+                        self._terms = None
+                    # Dampen repeated terms, so long sections don't dominate.
+                    postings[doc_id] = 1.0 + math.log(weight)
+                self._document_terms[doc_id] = list(weights)
+
+            self._pages[path] = doc_ids
+
+    def remove(self, path: str) -> None:
+        with self._lock:
+            for doc_id in self._pages.pop(path, []):
+                del self._documents[doc_id]
+                for term in self._document_terms.pop(doc_id):
+                    postings = self._postings[term]
+                    del postings[doc_id]
+                    if not postings:
+                        del self._postings[term]
+                        self._terms = None
+
+    def search(self, query: str, limit: int = 10) -> list[SearchResult]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            scores: dict[int, float] = {}
+            total = max(len(self._documents), 1)
+            for position, term in enumerate(terms):
+                is_last = position == len(terms) - 1
+                matches: dict[int, float] = {}
+                for candidate, boost in self._expand(term, prefix=is_last):
+                    postings = self._postings[candidate]
+                    idf = math.log(1.0 + total / len(postings))
+                    for doc_id, weight in postings.items():
+                        score = weight * idf * boost
+                        if score > matches.get(doc_id, 0.0):
+                            matches[doc_id] = score
+
+                # Every term in the query must match.
+                if position == 0:
+                    scores = matches
+                else:
+                    scores = {doc_id: scores[doc_id] + score for doc_id, score in matches.items() if doc_id in scores}
+                if not scores:
+                    return []
+
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [
+                SearchResult(
+                    ref=self._documents[doc_id].ref,
+                    title=self._documents[doc_id].title,
+                    page=self._documents[doc_id].page,
+                    score=round(score, 3),
+                )
+                for doc_id, score in best
+            ]
+
+    def _expand(self, term: str, prefix: bool) -> Iterator[tuple[str, float]]:
+        if term in self._postings:
+            yield term, 1.0
+        if not prefix:
+            return
+
+        if self._terms is None:
+            self._terms = sorted(self._postings)
+
+        count = 0
+        index = bisect_left(self._terms, term)
+        while index < len(self._terms) and count < self.MAX_PREFIX_TERMS:
+            candidate = self._terms[index]
+            if not candidate.startswith(term):
+                break
+            if candidate != term:
+                yield candidate, self.PREFIX_BOOST
+                count += 1
+            index += 1
+
+    def __len__(self) -> int:
+        return len(self._documents)
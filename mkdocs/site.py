@@ -1,38 +1,112 @@
+from bisect import bisect_left, insort
 from dataclasses import dataclass, field
-from typing import Any, Iterator, Optional
+from typing import Any, Generic, Iterable, Iterator, Optional, TypeVar
+import threading
 
 
-# Static Files
+T = TypeVar("T", "File", "Page")
 
-@dataclass
-class Files:
-    all: list["File"] = field(default_factory=list)
 
-    # We'll want to provide this to support the 'url' template tag.
-    # Ie... Make sure we can warn on `{{ "css/does_not_exist.css"|url }}`
-    #
-    # def lookup(self, path: str) -> Optional[Page]:
-    #     for page in self.all:
-    #         if page.path == path:
-    #             return page
+# Indexes
 
-    def lookup_url(self, url: str) -> Optional["File"]:
-        for file in self.all:
-            if file.url == url:
-                return file
-        return None
+def _url_key(url: str) -> str:
+    """
+    Normalize a URL into a lookup key, so that the trailing-slash
+    and 'index.html' variants of a URL all resolve to the same item.
+
+    url                  key
+    ---------------------------------------
+    /                  | /
+    /index.html        | /
+    /about/            | /about
+    /about             | /about
+    /about/index.html  | /about
+    """
+    if url.endswith('/index.html'):
+        url = url[:-len('index.html')]
+    return url.rstrip('/') or '/'
 
-    def __iter__(self) -> Iterator["File"]:
+
+def _url_of(item: Any) -> str:
+    return item.url
+
+
+@dataclass
+class _Index(Generic[T]):
+    """
+    A sorted collection of site items, with dict-backed indexes by url and by path.
+    """
+    all: list[T] = field(default_factory=list)
+
+    _by_url: dict[str, T] = field(init=False, repr=False, compare=False, default_factory=dict)
+    _by_path: dict[str, T] = field(init=False, repr=False, compare=False, default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self.all.sort(key=_url_of)
+        for item in self.all:
+            self._index(item)
+
+    def add(self, item: T) -> None:
+        existing = self._by_path.get(item.path)
+        if existing is not None:
+            self.remove(existing)
+        insort(self.all, item, key=_url_of)
+        self._index(item)
+
+    def remove(self, item: T) -> None:
+        """
+        Remove an item, if it is in the index.
+        """
+        # Locate the item by identity, rather than by dataclass equality.
+        index = bisect_left(self.all, item.url, key=_url_of)
+        while index < len(self.all) and self.all[index].url == item.url:
+            if self.all[index] is item:
+                del self.all[index]
+                self._unindex(item)
+                return
+            index += 1
+
+    def _index(self, item: T) -> None:
+        self._by_url[_url_key(item.url)] = item
+        self._by_path[item.path] = item
+
+    def _unindex(self, item: T) -> None:
+        if self._by_url.get(_url_key(item.url)) is item:
+            del self._by_url[_url_key(item.url)]
+        if self._by_path.get(item.path) is item:
+            del self._by_path[item.path]
+
+    def __iter__(self) -> Iterator[T]:
         return iter(self.all)
 
     def __len__(self) -> int:
         return len(self.all)
 
+
+# Static Files
+
+@dataclass
+class Files(_Index["File"]):
+    """
+    The static files for the site, ordered by URL.
+
+    Use `add()` and `remove()` rather than modifying `all` directly,
+    so that the lookup indexes stay in sync.
+    """
+
+    def lookup_url(self, url: str) -> Optional["File"]:
+        return self._by_url.get(_url_key(url))
+
+    # Provided to support the 'url' template tag.
+    # Ie... Make sure we can warn on `{{ "css/does_not_exist.css"|url }}`
+    def lookup_path(self, path: str) -> Optional["File"]:
+        return self._by_path.get(path)
+
     def __repr__(self) -> str:
         return f"Files({self.all!r})"
 
 
-@dataclass
+@dataclass(slots=True)
 class File:
     url: str
     path: str
@@ -44,32 +118,25 @@ class File:
 # Pages
 
 @dataclass
-class Pages:
-    all: list["Page"] = field(default_factory=list)
+class Pages(_Index["Page"]):
+    """
+    The markdown pages for the site, ordered by URL.
+
+    Use `add()` and `remove()` rather than modifying `all` directly,
+    so that the lookup indexes stay in sync.
+    """
 
     def lookup_url(self, url: str) -> Optional["Page"]:
-        for page in self.all:
-            if page.url == url:
-                return page
-        return None
+        return self._by_url.get(_url_key(url))
 
     def lookup_path(self, path: str) -> Optional["Page"]:
-        for page in self.all:
-            if page.path == path:
-                return page
-        return None
-
-    def __iter__(self) -> Iterator["Page"]:
-        return iter(self.all)
-
-    def __len__(self) -> int:
-        return len(self.all)
+        return self._by_path.get(path)
 
     def __repr__(self) -> str:
         return f"Pages({self.all!r})"
 
 
-@dataclass
+@dataclass(slots=True)
 class Page:
     url: str
     path: str
@@ -86,12 +153,81 @@ class Page:
         return f"Page({self.path!r})"
 
 
-@dataclass
+@dataclass(slots=True)
+class PageView:
+    """
+    A single render of a page, as passed to the templates.
+
+    Holds all of the per-render state, so that pages can be rendered
+    concurrently without modifying the shared site.
+    """
+    page: Page
+    text: str = ""
+    html: str = ""
+    sections: list["Section"] = field(default_factory=list)
+
+    # The source paths referenced by links on the page,
+    # mapped to the URL that each one resolved to.
+    links: dict[str, Optional[str]] = field(default_factory=dict, repr=False)
+    # The '#fragment' anchors linked to, by the source path of the page they are on.
+    anchors: dict[str, list[str]] = field(default_factory=dict, repr=False)
+
+    # The navigation items that are "active" for this render,
+    # ie. the current page and its ancestors, by identity.
+    _active: frozenset[int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.page.navigation is None:
+            self._active = frozenset()
+        else:
+            self._active = frozenset(id(nav) for nav in self.page.navigation.breadcrumbs)
+
+    def is_active(self, nav: "NavItem") -> bool:
+        return id(nav) in self._active
+
+    def any_active(self, navs: list["NavItem"]) -> bool:
+        return any(id(nav) in self._active for nav in navs)
+
+    @property
+    def breadcrumbs(self) -> list["NavItem"]:
+        # The page's nav item and its ancestors, with the root first.
+        if self.page.navigation is None:
+            return []
+        return self.page.navigation.breadcrumbs
+
+    @property
+    def url(self) -> str:
+        return self.page.url
+
+    @property
+    def path(self) -> str:
+        return self.page.path
+
+    @property
+    def context(self) -> dict:
+        return self.page.context
+
+    @property
+    def navigation(self) -> Optional["NavItem"]:
+        return self.page.navigation
+
+    @property
+    def is_homepage(self) -> bool:
+        return self.page.is_homepage
+
+    def __repr__(self) -> str:
+        return f"PageView({self.page.path!r})"
+
+
+@dataclass(slots=True)
 class Section:
     title: str
     id: str
     level: int
 
+    # The plain text content of the section, for search indexes.
+    text: str = ""
+
     def __repr__(self) -> str:
         return f"Section({self.title!r}, level={self.level})"
 
@@ -112,7 +248,7 @@ class Navigation:
         return f"Navigation({self.all!r})"
 
 
-@dataclass
+@dataclass(slots=True)
 class NavItem:
     title: str
     level: int
@@ -126,10 +262,6 @@ class NavItem:
     next: Optional["NavItem"] = None
     children: list["NavItem"] = field(default_factory=list)
 
-    # state indicating if the navigation item is "active"
-    # ie. either the current page or one of its ancestors.
-    is_active = False
-
     @property
     def breadcrumbs(self) -> list["NavItem"]:
         # Returns nav and all its ancestors,
@@ -147,6 +279,96 @@ class NavItem:
         return f"NavItem({self.title!r})"
 
 
+# Links
+
+@dataclass(slots=True)
+class BrokenLink:
+    source: str
+    target: str
+    # The missing anchor, when the target page itself exists.
+    fragment: str = ""
+
+    def __str__(self) -> str:
+        if self.fragment:
+            return f"{self.source} -> {self.target}#{self.fragment}"
+        return f"{self.source} -> {self.target}"
+
+
+@dataclass
+class LinkGraph:
+    """
+    The links from each page to other pages, by source path,
+    with a reverse index from each referenced path to the pages linking to it.
+
+    Links are recorded as the referenced source paths, mapped to the URL
+    that each one resolved to, or `None` for a link to a missing page.
+    """
+    _links: dict[str, dict[str, Optional[str]]] = field(init=False, repr=False, default_factory=dict)
+    _anchors: dict[str, dict[str, list[str]]] = field(init=False, repr=False, default_factory=dict)
+    _referrers: dict[str, set[str]] = field(init=False, repr=False, default_factory=dict)
+    _lock: threading.Lock = field(init=False, repr=False, compare=False, default_factory=threading.Lock)
+
+    def record(self, source: str, links: dict[str, Optional[str]], anchors: dict[str, list[str]]) -> None:
+        with self._lock:
+            self._unlink(source)
+            self._links[source] = dict(links)
+            self._anchors[source] = {target: list(fragments) for target, fragments in anchors.items()}
+            for target in links:
+                self._referrers.setdefault(target, set()).add(source)
+
+    def remove(self, source: str) -> None:
+        with self._lock:
+            self._unlink(source)
+
+    def links(self, source: str) -> dict[str, Optional[str]]:
+        with self._lock:
+            return dict(self._links.get(source, {}))
+
+    def referrers(self, targets: Iterable[str]) -> set[str]:
+        """
+        Return the pages that link to any of the given paths.
+        """
+        with self._lock:
+            return set().union(*(self._referrers.get(target, ()) for target in targets))
+
+    def broken(self, pages: "Pages") -> list[BrokenLink]:
+        """
+        Return every link to a missing page, or to an anchor that is not
+        the id of one of the sections on the referenced page.
+        """
+        with self._lock:
+            links = list(self._links.items())
+            anchors = dict(self._anchors)
+
+        broken = []
+        section_ids: dict[str, set[str]] = {}
+        for source, targets in sorted(links):
+            for target, url in sorted(targets.items()):
+                if url is None:
+                    broken.append(BrokenLink(source, target))
+            for target, fragments in sorted(anchors.get(source, {}).items()):
+                if target not in section_ids:
+                    page = pages.lookup_path(target)
+                    if page is None:
+                        continue
+                    section_ids[target] = {section.id for section in page.sections}
+                for fragment in fragments:
+                    if fragment not in section_ids[target]:
+                        broken.append(BrokenLink(source, target, fragment))
+        return broken
+
+    def _unlink(self, source: str) -> None:
+        for target in self._links.pop(source, {}):
+            referrers = self._referrers[target]
+            referrers.discard(source)
+            if not referrers:
+                del self._referrers[target]
+        self._anchors.pop(source, None)
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+
 # Site
 
 @dataclass
@@ -157,3 +379,4 @@ class Site:
     pages: "Pages" = field(default_factory=Pages)
     files: "Files" = field(default_factory=Files)
     navigation: "Navigation" = field(default_factory=Navigation)
+    links: "LinkGraph" = field(default_factory=LinkGraph)
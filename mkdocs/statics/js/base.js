@@ -1 +1,213 @@
-hljs.highlightAll();
+// highlight.js is left out when code is highlighted as pages are rendered.
+if (window.hljs) hljs.highlightAll();
+
+// Search...
+//
+// Queries go to the server's search endpoint where there is one, such as
+// under `mkdocs serve`. Otherwise the prebuilt search index is used, which is
+// downloaded the first time that it is needed. The index is split into shards,
+// which are loaded one at a time, and the results are updated as each shard
+// arrives, so that the first results are shown before the whole index has loaded.
+document.addEventListener("DOMContentLoaded", () => {
+  const input = document.getElementById("search-input");
+  const results = document.getElementById("search-results");
+  if (!input || !results) return;
+
+  const baseUrl = input.dataset.baseUrl;
+  let useEndpoint = true;
+  const shards = [];
+  let loading = null;
+  // The query to update the results for, as more shards are loaded.
+  let pending = "";
+
+  const searchEndpoint = (query) =>
+    fetch(`${baseUrl}search?q=${encodeURIComponent(query)}`).then((response) => {
+      const contentType = response.headers.get("content-type") || "";
+      if (!response.ok || !contentType.includes("json")) throw new Error("No search endpoint");
+      return response.json();
+    }).then((data) => data.results.map((doc) => ({ score: doc.score, doc })));
+
+  const loadShard = (shard) => {
+    const documents = new Map(shard.documents.map((doc) => [doc.ref, doc]));
+    const index = shard.index ? lunr.Index.load(shard.index) : lunr(function () {
+      this.ref("ref");
+      this.field("title", { boost: 10 });
+      this.field("text");
+      shard.documents.forEach((doc) => this.add(doc));
+    });
+    return { index, documents };
+  };
+
+  const loadShards = () => {
+    if (loading === null) {
+      loading = fetch(baseUrl + "search/index.json")
+        .then((response) => response.json())
+        .then(async (manifest) => {
+          for (const shard of manifest.shards) {
+            const response = await fetch(baseUrl + shard.url);
+            shards.push(loadShard(await response.json()));
+            if (pending && input.value.trim() === pending) render(search(pending, shards));
+          }
+        })
+        .catch(() => {});
+    }
+    return loading;
+  };
+
+  const search = (query, loaded) => {
+    const matches = [];
+    for (const shard of loaded) {
+      let found = [];
+      try {
+        found = shard.index.search(query);
+      } catch (error) {
+        // Ignore incomplete queries, such as a trailing "+" or ":".
+      }
+      for (const match of found) {
+        matches.push({ score: match.score, doc: shard.documents.get(match.ref) });
+      }
+    }
+    return matches.sort((a, b) => b.score - a.score).slice(0, 10);
+  };
+
+  const render = (matches) => {
+    results.replaceChildren(...matches.map(({ doc }) => {
+      const link = document.createElement("a");
+      link.href = doc.ref;
+      link.textContent = doc.title === doc.page ? doc.title : `${doc.page} › ${doc.title}`;
+      return link;
+    }));
+    results.classList.toggle("active", matches.length > 0);
+  };
+
+  const searchShards = (query) => {
+    pending = query;
+    loadShards();
+    return Promise.resolve(search(query, shards));
+  };
+
+  input.addEventListener("focus", () => {
+    if (!useEndpoint) loadShards();
+  });
+  input.addEventListener("input", () => {
+    const query = input.value.trim();
+    if (!query) {
+      render([]);
+      return;
+    }
+    const matches = useEndpoint ? searchEndpoint(query).catch(() => {
+      useEndpoint = false;
+      return searchShards(query);
+    }) : searchShards(query);
+    matches.then((found) => {
+      if (input.value.trim() === query) render(found);
+    });
+  });
+});
+
+// Instant navigation...
+//
+// Each page has a fragment alongside it, eg. 'about/index.fragment.html',
+// with only the parts of the page that change from page to page. Links are
+// prefetched on hover, and followed by swapping the fragment into place.
+// Pages that expand different sections of the navigation are loaded in full.
+document.addEventListener("DOMContentLoaded", () => {
+  const nav = document.getElementById("bd-docs-nav");
+  const toc = document.querySelector('[data-fragment="toc"]');
+  const content = document.querySelector('[data-fragment="content"]');
+  if (!nav || !toc || !content || !window.fetch || !window.history.pushState) return;
+
+  const fragments = new Map();
+  let currentPath = location.pathname;
+
+  const fragmentUrl = (url) => {
+    let path = url.pathname;
+    if (path.endsWith("/")) path += "index.html";
+    if (!path.endsWith(".html")) return null;
+    return path.slice(0, -".html".length) + ".fragment.html";
+  };
+
+  const loadFragment = (url) => {
+    const key = fragmentUrl(url);
+    if (key === null) return Promise.reject(new Error("No fragment"));
+    if (!fragments.has(key)) {
+      const loaded = fetch(key).then((response) => {
+        if (!response.ok) throw new Error("No fragment");
+        return response.text();
+      }).then((html) => {
+        const doc = new DOMParser().parseFromString(html, "text/html");
+        const parts = {};
+        doc.querySelectorAll("[data-fragment]").forEach((part) => {
+          parts[part.dataset.fragment] = part;
+        });
+        return parts;
+      });
+      // Don't hold on to failures, so the next attempt tries again.
+      loaded.catch(() => fragments.delete(key));
+      fragments.set(key, loaded);
+    }
+    return fragments.get(key);
+  };
+
+  const followable = (link) =>
+    link && link.origin === location.origin && !link.target && !link.hasAttribute("download") &&
+    fragmentUrl(link) !== null;
+
+  const markActive = (url) => {
+    nav.querySelectorAll("a.bd-toc-link").forEach((link) => {
+      const children = link.nextElementSibling;
+      const expanded = children !== null && children.classList.contains("bd-toc-children");
+      link.classList.toggle("active", expanded || link.pathname === url.pathname);
+    });
+  };
+
+  const swap = (url, parts, push) => {
+    const state = parts.sidebar_state ? parts.sidebar_state.textContent : null;
+    if (!parts.content || !parts.toc || state !== nav.dataset.sidebarState) {
+      location.href = url.href;
+      return;
+    }
+    if (parts.title) document.title = parts.title.textContent;
+    toc.innerHTML = parts.toc.innerHTML;
+    content.innerHTML = parts.content.innerHTML;
+    markActive(url);
+    if (window.hljs) content.querySelectorAll("pre code").forEach((block) => hljs.highlightElement(block));
+
+    if (push) history.pushState(null, "", url.href);
+    currentPath = url.pathname;
+    const target = url.hash && document.getElementById(decodeURIComponent(url.hash.slice(1)));
+    if (target) {
+      target.scrollIntoView();
+    } else {
+      window.scrollTo(0, 0);
+    }
+  };
+
+  const navigate = (url, push) => {
+    loadFragment(url).then((parts) => swap(url, parts, push), () => {
+      location.href = url.href;
+    });
+  };
+
+  document.addEventListener("mouseover", (event) => {
+    const link = event.target.closest("a");
+    if (followable(link)) loadFragment(link).catch(() => {});
+  });
+
+  document.addEventListener("click", (event) => {
+    if (event.defaultPrevented || event.button !== 0) return;
+    if (event.metaKey || event.ctrlKey || event.shiftKey || event.altKey) return;
+    const link = event.target.closest("a");
+    if (!followable(link)) return;
+    // Leave links within the current page to the browser.
+    if (link.pathname === location.pathname && link.search === location.search) return;
+    event.preventDefault();
+    navigate(new URL(link.href), true);
+  });
+
+  window.addEventListener("popstate", () => {
+    // Moving between anchors on the same page doesn't need a swap.
+    if (location.pathname === currentPath) return;
+    navigate(new URL(location.href), false);
+  });
+});
@@ -1,6 +1,151 @@
 import os
+import hashlib
 import json
-import yaml
+import re
+from typing import Iterator, Optional, Sequence, Tuple
+
+
+# Files in the docs directory with these extensions are pages,
+# and any other files are copied to the site as they are.
+MARKDOWN_EXTENSIONS = ('.md', '.markdown')
+
+
+def is_markdown(path: str) -> bool:
+    return path.lower().endswith(MARKDOWN_EXTENSIONS)
+
+
+class IgnoreRules:
+    """
+    Gitignore-style patterns, for excluding files within a directory.
+
+    Patterns without a '/' match the name of a file or directory at any
+    depth, and otherwise match its path from the top of the directory.
+    A trailing '/' only matches directories, a leading '!' re-includes
+    anything excluded by an earlier pattern, '*' matches within a single
+    name, and '**' matches across directories.
+
+    Hidden files and directories, whose names start with '.', are always ignored.
+
+    ```python
+    rules = IgnoreRules(['drafts/', '*.tmp', '/README.md'])
+    assert rules.ignores('topics/drafts/intro.md')
+    assert not rules.ignores('topics/README.md')
+    ```
+    """
+
+    def __init__(self, patterns: Sequence[str] = ()) -> None:
+        self._rules: list[Tuple[re.Pattern, bool, bool, bool]] = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negate = pattern.startswith('!')
+            if negate:
+                pattern = pattern[1:]
+            directory_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            anchored = '/' in pattern
+            self._rules.append((_translate_pattern(pattern.lstrip('/')), negate, directory_only, anchored))
+
+    def ignored(self, path: str, is_dir: bool = False) -> bool:
+        """
+        Determine if a file or directory is ignored, given that
+        the directories that it is within are not.
+        """
+        name = os.path.basename(path)
+        if name.startswith('.'):
+            return True
+        ignored = False
+        posix_path = path.replace(os.sep, '/')
+        for regex, negate, directory_only, anchored in self._rules:
+            if directory_only and not is_dir:
+                continue
+            if regex.match(posix_path if anchored else name):
+                ignored = not negate
+        return ignored
+
+    def ignores(self, path: str) -> bool:
+        """
+        Determine if a file is ignored, either itself or by being within an ignored directory.
+        """
+        parts = path.split(os.sep)
+        for index in range(1, len(parts)):
+            if self.ignored(os.sep.join(parts[:index]), is_dir=True):
+                return True
+        return self.ignored(path)
+
+
+def _translate_pattern(pattern: str) -> re.Pattern:
+    regex = ''
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith('**/', index):
+            regex += '(?:.*/)?'
+            index += 3
+        elif pattern.startswith('**', index):
+            regex += '.*'
+            index += 2
+        elif pattern[index] == '*':
+            regex += '[^/]*'
+            index += 1
+        elif pattern[index] == '?':
+            regex += '[^/]'
+            index += 1
+        else:
+            regex += re.escape(pattern[index])
+            index += 1
+    return re.compile(regex + r'\Z')
+
+
+def scan_directory(directory: str, ignore: Optional[IgnoreRules] = None) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Yields the path of each file within a directory, relative to that directory,
+    along with its stat result, so that callers don't need to stat it again.
+
+    Files are yielded as the directory is scanned, and ignored
+    directories are skipped without being scanned at all.
+    Symlinks to files are followed, but symlinks to directories are not.
+    """
+    pending = ['']
+    while pending:
+        relative = pending.pop()
+        try:
+            scan = os.scandir(os.path.join(directory, relative))
+        except OSError:
+            continue
+        with scan:
+            for entry in scan:
+                path = os.path.join(relative, entry.name) if relative else entry.name
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if ignore is not None and ignore.ignored(path, is_dir):
+                    continue
+                if is_dir:
+                    pending.append(path)
+                elif entry.is_file():
+                    yield path, entry.stat()
+
+
+class DocsScan:
+    """
+    The files in the docs directory, from a single scan that is shared by
+    the handlers. Pages are markdown files, and any other files are static
+    files. Each is listed along with its stat result. See `MkDocs.initialize()`.
+    """
+
+    def __init__(self, directory: str, ignore: IgnoreRules) -> None:
+        self.directory = directory
+        self.ignore = ignore
+        self.pages: list[Tuple[str, os.stat_result]] = []
+        self.files: list[Tuple[str, os.stat_result]] = []
+
+    def scan(self) -> None:
+        self.clear()
+        for path, stat in scan_directory(self.directory, self.ignore):
+            (self.pages if is_markdown(path) else self.files).append((path, stat))
+
+    def clear(self) -> None:
+        self.pages = []
+        self.files = []
 
 
 def list_files_within_directory(directory: str) -> list[str]:
@@ -30,13 +175,23 @@ def list_files_within_directory(directory: str) -> list[str]:
     ]
     ```
     """
-    filepaths = []
-    for dirpath, _, filenames in os.walk(directory):
-        for filename in filenames:
-            path = os.path.join(dirpath, filename)
-            path = os.path.relpath(path, directory)
-            filepaths.append(path)
-    return filepaths
+    return [path for path, _ in scan_directory(directory)]
+
+
+def path_within_directory(path: str, directory: str) -> Optional[str]:
+    """
+    Returns the path relative to the given directory,
+    or `None` if the path is not within that directory.
+
+    ```python
+    assert path_within_directory('docs/topics/topic1.md', 'docs') == 'topics/topic1.md'
+    assert path_within_directory('statics/css/base.css', 'docs') is None
+    ```
+    """
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(directory))
+    if relative == os.curdir or relative == os.pardir or relative.startswith(os.pardir + os.sep):
+        return None
+    return relative
 
 
 def url_for_path(path: str, base_url: str = '/') -> str:
@@ -66,5 +221,26 @@ def load_json(path: str) -> dict:
 
 
 def load_yaml(path: str) -> dict:
+    import yaml
+
     with open(path, 'r') as file:
         return yaml.safe_load(file)
+
+
+def hash_file(path: str) -> str:
+    """
+    Returns a hex digest of the contents of the file at the given path.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_data(data) -> str:
+    """
+    Returns a hex digest of some JSON-serializable data.
+    """
+    text = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
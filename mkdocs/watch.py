@@ -0,0 +1,150 @@
+from typing import Callable, Iterator
+import os
+import threading
+
+try:
+    # Use native filesystem events (eg. inotify), where available.
+    from watchdog.events import FileSystemEvent, FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover
+    Observer = None
+
+
+class Watcher:
+    """
+    Watches a set of files and directories, and calls back with the
+    paths that have been added, modified or removed.
+
+    Uses `watchdog` for native filesystem events if it is installed,
+    and otherwise falls back to polling for changes. In either case
+    changes are batched, and delivered from a single background thread.
+    """
+
+    def __init__(self, paths: list[str], callback: Callable[[set[str]], None], interval: float = 0.5) -> None:
+        self._paths = [os.path.abspath(path) for path in paths]
+        self._callback = callback
+        self._interval = interval
+        self._changes: set[str] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._observer = None
+        self._snapshot: dict[str, tuple[int, int]] = {}
+
+    def start(self) -> None:
+        if Observer is not None:
+            self._observer = Observer()
+            handler = _EventHandler(self)
+            for path in self._paths:
+                if os.path.isdir(path):
+                    self._observer.schedule(handler, path, recursive=True)
+                else:
+                    self._observer.schedule(handler, os.path.dirname(path), recursive=False)
+            self._observer.start()
+        else:
+            self._snapshot = self._scan()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def add_change(self, path: str) -> None:
+        if self._is_watched(path):
+            with self._lock:
+                self._changes.add(path)
+
+    # ...
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            if self._observer is None:
+                self._poll()
+            with self._lock:
+                changes, self._changes = self._changes, set()
+            if changes:
+                self._callback(changes)
+
+    def _poll(self) -> None:
+        snapshot = self._scan()
+        for path in snapshot.keys() | self._snapshot.keys():
+            if snapshot.get(path) != self._snapshot.get(path):
+                self.add_change(path)
+        self._snapshot = snapshot
+
+    def _scan(self) -> dict[str, tuple[int, int]]:
+        return {
+            path: (stat.st_mtime_ns, stat.st_size)
+            for path, stat in self._walk()
+        }
+
+    def _walk(self) -> Iterator[tuple[str, os.stat_result]]:
+        for root in self._paths:
+            if os.path.isfile(root):
+                yield root, os.stat(root)
+                continue
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        yield path, os.stat(path)
+                    except OSError:
+                        pass
+
+    def _is_watched(self, path: str) -> bool:
+        return any(
+            path == root or path.startswith(root + os.sep)
+            for root in self._paths
+        )
+
+
+if Observer is not None:
+    class _EventHandler(FileSystemEventHandler):
+        def __init__(self, watcher: Watcher) -> None:
+            self._watcher = watcher
+
+        def on_any_event(self, event: FileSystemEvent) -> None:
+            if event.is_directory or event.event_type in ('opened', 'closed', 'closed_no_write'):
+                return
+            self._watcher.add_change(os.path.abspath(event.src_path))
+            dest_path = getattr(event, 'dest_path', '')
+            if dest_path:
+                self._watcher.add_change(os.path.abspath(dest_path))
+
+
+RELOAD_URL = '/_mkdocs/events'
+
+# Included in served pages, to have them reload whenever anything changes.
+RELOAD_SCRIPT = f'''<script>
+  new EventSource("{RELOAD_URL}").addEventListener("reload", () => location.reload());
+</script>
+'''
+
+
+class Reloader:
+    """
+    Broadcasts reload events to any open browser tabs, as server-sent events.
+    """
+
+    def __init__(self, keepalive: float = 15.0) -> None:
+        self._keepalive = keepalive
+        self._version = 0
+        self._condition = threading.Condition()
+
+    def notify(self) -> None:
+        with self._condition:
+            self._version += 1
+            self._condition.notify_all()
+
+    def stream(self) -> Iterator[str]:
+        version = self._version
+        yield 'retry: 1000\n\n'
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._version != version, timeout=self._keepalive)
+                current = self._version
+            if current != version:
+                version = current
+                yield f'event: reload\ndata: {version}\n\n'
+            else:
+                yield ': keepalive\n\n'